@@ -1,6 +1,12 @@
 import pygame
 import virtualKeyboard
+import tmd3Engine
+import tmd3Decider
+import tmd3Worker
+import tmd3Journal
+import tmd3Trace
 import time
+import math
 
 hasHardware = True
 try:
@@ -76,6 +82,44 @@ gotoSymbols = ['A', 'B', 'C', 'D', 'E', 'F', 'H', ' ']
 # If true state machine will run without stopping, otherwise state machine will run one step at a time.
 runState = 'STEP'
 
+# If true RUN uses the macro machine (block compressed) simulation. Toggled with the M key.
+macroMode = False
+
+# If set RUN stops when the decider proves the machine never halts. Toggled with the D key.
+decider = None
+
+# The background worker running the machine in RUN mode, None when not running.
+worker = None
+
+# If true RUN uses a worker process instead of a thread. Toggled with the P key.
+processMode = False
+
+# Undo journal of the transitions made in STEP and DEMO mode. Stepped back with
+# the BACKSPACE key and rewound to a step with the K key.
+journal = tmd3Journal.Journal()
+
+# The TraceRecorder recording every transition to a file, None when not
+# recording. Toggled with the T key. RUN uses the plain machine in a worker
+# thread while recording.
+trace = None
+
+# True while the worker is fast forwarding, see fastForward().
+fastForwarding = False
+
+# Transitions owed to a speed limited RUN, carried over between frames.
+speedCredit = 0.0
+
+# The state highlighted while the worker runs.
+progressState = None
+
+# The number of non blank cells in the last progress drawn, shown by the HUD
+# while the worker runs.
+progressSigma = 0
+
+# If true the throughput counters are shown in the top right. Toggled with the H key.
+hudShown = False
+lastHudTime = 0.0
+
 # Set to True if the play button was pressed.
 playPressed = False
 stateMachineRunning = False
@@ -83,12 +127,9 @@ stateMachineRunning = False
 # Set to true when a step has been setup and is waiting for the play button to be pressed.
 stepReady = False
 
-# Start of state machine running code.
-currentState ='A'
-currentStep = 'READ'
-
-# The current transition being processed.
-currentTransition = None
+# The state transition table, tape, tape head and running state (A-READ at
+# start up) are all held by the headless engine.
+machine = tmd3Engine.Machine()
 
 # Clock required by GUI manager.
 clock = pygame.time.Clock()
@@ -96,26 +137,15 @@ clock = pygame.time.Clock()
 # Only process mouse over events if the pointer has actually moved.
 lastMousePosition = (0, 0)
 
-# Keep track of the tape movement direction for the last transition.
-lastMoveDirection = ' '
-
 # Last file name loaded or saved.
 lastFilename = ''
 
-# Dictionary to hold the finite state table.
-stateTable = {}
-
 # Remember where the individual state panel pieces (A, B, C, D, E, F) have been drawn.
 statePanelOffsets = {}
 
 # Remember where all of the panel labels have been drawn.
 panelLabelPositions = {}
 
-# Tape values will be stored here.
-TAPE_NUMBER_CELLS = 100000
-tape = bytearray(TAPE_NUMBER_CELLS)
-tapeHead  = int(TAPE_NUMBER_CELLS / 2) # The read/write position on the tape
-
 # Color constants.
 BLACK = 0, 0, 0
 GREY = 128, 128, 128
@@ -163,9 +193,42 @@ PANEL_ROWS = 5
 PANEL_CELL_FONT_SIZE = 27
 PANEL_LABEL_FONT_SIZE = 25
 
+# Throughput HUD, between the tape head arrow and the exit button. It is redrawn
+# at most every HUD_INTERVAL seconds.
+HUD_START_X = 450
+HUD_START_Y = 6
+HUD_WIDTH = 300
+HUD_HEIGHT = 57
+HUD_LINE_HEIGHT = 19
+HUD_FONT_SIZE = 18
+HUD_INTERVAL = 0.25
+
+# Step counter shown in RUN mode, above the reset and halt buttons.
+STEPS_START_X = 540
+STEPS_START_Y = 175
+STEPS_WIDTH = 250
+STEPS_HEIGHT = 30
+
+# Frames drawn per second while the worker runs. The rest of the time is left
+# to the worker.
+RUN_FRAME_RATE = 30
+
+# RUN speeds in transitions per second. None runs as fast as possible in the
+# background worker. A slower RUN makes as many transitions each frame as the
+# speed needs, but never more than SPEED_MAX_LAG seconds' worth.
+RUN_SPEEDS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000, None)
+SPEED_MAX_LAG = 0.1
+
+# Index into RUN_SPEEDS of the RUN speed, at first full speed. Changed with the
+# + and - keys.
+speedIndex = len(RUN_SPEEDS) - 1
+
 # Create a font for the tiny cell numbers.
 cellNumberFont = pygame.font.SysFont('arialbold', TAPE_CELL_NUMBER_FONT_SIZE)
 
+# Create a font for the throughput HUD.
+hudFont = pygame.font.SysFont('arial', HUD_FONT_SIZE)
+
 # Cache the tape symbols needed.
 cellFont = pygame.font.SysFont('arial', TAPE_CELL_FONT_SIZE)
 cellSymbols = {
@@ -638,22 +701,21 @@ def checkForMouseovers(buttons):
 
 # Handle the left button mouse press.
 def pushButtonLeft(_):
-    global tapeHead
-    if tapeHead < TAPE_NUMBER_CELLS - int(TAPE_CELLS/2) - 1:
-        tapeHead += 1
-        drawTape()
+    machine.shiftHead(1)
+    machineEdited()
+    drawTape()
 
 # Handle the right button mouse press. 
 def pushButtonRight(_):
-    global tapeHead
-    if tapeHead > int(TAPE_CELLS/2) + 1:
-        tapeHead -= 1
-        drawTape()
+    machine.shiftHead(-1)
+    machineEdited()
+    drawTape()
 
 # Handle the down button mouse press.
 def pushButtonDown(_):
-    tape[tapeHead] = (tape[tapeHead] + 1) % 7;
-    drawTapeCell(tapeHead, int(TAPE_CELLS/2))
+    machine.writeCell(machine.tapeHead, (machine.tape[machine.tapeHead] + 1) % 6)
+    machineEdited()
+    drawTapeCell(machine.tapeHead, int(TAPE_CELLS/2))
 
 # Handle the reset button mouse press.    
 def pushButtonReset(_):
@@ -668,43 +730,58 @@ def pushButtonReset(_):
 
     # Clear the events queue.
     if answer == 'YES':
-        clearStateTable()
+        machine.clearStateTable()
+        machineEdited()
     redrawStateTable() 
 
 # Set the state machine to it's initial position (A-READ) but not running. 
 # Optionally clear the tape to blanks (0) and center the tape head.   
 def resetRuntime(resetTape = False):
+    machine.steps = 0
+    if machine.hits != None:
+        machine.startProfile()
+    screen.fill(WHITE, pygame.Rect(STEPS_START_X, STEPS_START_Y, STEPS_WIDTH, STEPS_HEIGHT))
     if resetTape:
-        clearTape()
+        machine.clearTape()
         drawTape()
     resetPanelLabels()
     resetState('A', 'READ')
+    machineEdited()
+
+# Call when the tape, tape head or state transition table has been changed by
+# hand. The undo journal starts again, and a trace being recorded starts a new
+# chunk from here.
+def machineEdited():
+    journal.reset(machine)
+    if trace != None:
+        trace.edited(machine)
 
 # Set the running state.
 def resetState(state, step):
-    global currentState 
-    global currentStep
     global stepReady
     global playPressed
     global stateMachineRunning
-    currentState = state
-    currentStep = step
+    machine.currentState = state
+    machine.currentStep = step
     stepReady = False
     playPressed = False
     stateMachineRunning = False
 
 # Make sure that all of the panel labels for the state passed are not highlighted.
 def resetPanelLabels():
-    global currentState 
-    drawPanelState(currentState)
-    drawPanelLabel(currentState, 'READ')
-    drawPanelLabel(currentState, 'WRITE')
-    drawPanelLabel(currentState, 'MOVE')
-    drawPanelLabel(currentState, 'GOTO')
-
-# Handle the halt button mouse press.
+    drawPanelState(machine.currentState)
+    drawPanelLabel(machine.currentState, 'READ')
+    drawPanelLabel(machine.currentState, 'WRITE')
+    drawPanelLabel(machine.currentState, 'MOVE')
+    drawPanelLabel(machine.currentState, 'GOTO')
+
+# Handle the halt button mouse press. A run in the worker is asked to stop, and
+# the main loop halts the state machine once it has.
 def pushButtonHalt(_):
-    haltStateMachine()
+    if worker != None:
+        worker.halt()
+    else:
+        haltStateMachine()
 
 # Switch the play button to green (running) and the halt button to normal.
 def setRunningMode():
@@ -760,42 +837,32 @@ def showErrorMessage(ex):
 
     # Clear the events queue.
     if answer == 'OK':
-        clearStateTable()
+        machine.clearStateTable()
     redrawStateTable() 
 
 # Handle the load label button mouse press.
 def pushButtonLoad(_):
-    global stateTable
-    global tape
-    global tapeHead
-    global currentState
-    global currentStep
-    global currentTransition
-    
     dialog = Dialog(screen, 'Load', 'Enter the name of the file to load from then press OK.', ['OK', 'CANCEL'], panelLabelFont, True)
     buttonPressed,filename = dialog.run()
     
     if buttonPressed == 'OK' and filename != None:
         try:
-            f = open(filename+'.tmd3',"r")
-            saveText = f.read()
-            f.close()
-            save = eval(saveText)
-            compressed = save['tape']
-            decodeTape(compressed)
-            stateTable = save['table']
-            tapeHead = save['tapehead']
-            state = save['state']
-            step = save['step']
-            currentTransition = save['transition']
+            # Remove the highlights from the current state before it is replaced.
+            resetPanelLabels()
+            machine.loadWorkspace(filename)
+            if machine.hits != None:
+                machine.startProfile()
+            state = machine.currentState
+            step = machine.currentStep
             
             drawTape()
             redrawStateTable()
             showButton(loadButton)
+            drawStepCounter(machine.steps)
             
-            resetPanelLabels()
             resetState(state, step)
-            if currentTransition !=  None:
+            machineEdited()
+            if machine.currentTransition !=  None:
                 drawPanelState(state, True)
                 drawPanelLabel(state, step, True)
             
@@ -806,91 +873,16 @@ def pushButtonLoad(_):
             # Clear the events queue.
             pygame.event.clear()
 
-# Create a text file with the current tape and state machine information.          
-def dumpWorkspace():
-    global tape
-    global stateTable
-    
-    # Build the output string here.
-    workspace = ""
-    
-    # Find the position of the first non zero symbol on the tape.
-    for start in range(0, TAPE_NUMBER_CELLS-1):
-        if tape[start] != 0:
-            break
-    # Find the position of the last non zero symbol on the tape.
-    for end in range(TAPE_NUMBER_CELLS-1, 0, -1):
-        if tape[end] != 0:
-            break
-        
-    # Show the range of non blank (zero) cells.   
-    workspace += "Showing tape from cell {0} to cell {1}.\n".format(start-int(TAPE_NUMBER_CELLS/2), end-int(TAPE_NUMBER_CELLS/2))
-    for pos in range(0, len(workspace)-1):
-        workspace += '~'
-    workspace += '\n'
-    
-    # Show the tape and count the number of each symbol.
-    counts = {}
-    counts['0'] = 0
-    counts['1'] = 0
-    counts['2'] = 0
-    counts['3'] = 0
-    counts['4'] = 0
-    counts['b'] = 0
-
-    
-    for pos in range(start, end+1):
-        counts[str(tape[pos])] += 1
-        if tape[pos] == 5:
-            workspace += "| b "
-        else:
-            workspace += "| {0} ".format(str(tape[pos]))
-    workspace += "|\n\nCounts\n~~~~~~\n"
-    
-    for key, value in counts.items():
-        if key == '6':
-            key = 'b'
-        workspace += key + ': ' + str(value) + '\n'
-    
-    workspace += '\nState Transition Table\n~~~~~~~~~~~~~~~~~~~~~~\n'
-    for state in ('A', 'B', 'C', 'D','E','F'):
-        workspace += '          '+state+'\n'
-        for row in range(0, 4):
-            for col in range(0,5):
-                value = stateTable[state+str(col)][row]
-                if value == ' ':
-                    value = '-'
-                workspace += '| ' + value + ' '   
-            workspace += '|\n'
-        workspace += '\n'
-    return workspace
-
 # Handle the save label button mouse press.
 def pushButtonSave(_):
-    global stateTable
     dialog = Dialog(screen, 'Save', 'Enter the name of the file to save to then press OK.', ['OK', 'CANCEL'], panelLabelFont, True)
     buttonPressed, filename = dialog.run()
     # Clear the events queue.
     pygame.event.clear()
     if buttonPressed == 'OK' and filename != None:
-        compressed = encodeTape()
         try:
-            # Save the raw tape and state transition table.
-            save = {}
-            save['tape'] = compressed
-            save['table'] = stateTable
-            save['tapehead'] = tapeHead
-            save['state'] = currentState
-            save['step'] = currentStep
-            save['transition'] = currentTransition
-            f = open(filename+'.tmd3',"w")
-            f.write( str(save) )
-            f.close()
-            
-            # Save a readable version of the tape and state transition table.
-            f = open(filename+'.txt',"w")
-            f.write( dumpWorkspace() )
-            f.close()
+            # Save the raw tape and state transition table along with a readable version.
+            machine.saveWorkspace(filename)
             
             showButton(saveButton)
             
@@ -900,6 +892,7 @@ def pushButtonSave(_):
 # Handle the exit label button mouse press.
 def pushButtonExit(_):
     global done
+    stopWorker()
     pygame.quit()
     done = True
 
@@ -945,6 +938,127 @@ def pushButtonRun(button):
         resetPanelLabels()
         redrawStateTable()
 
+# Show the RUN options that are switched on in the window caption.
+def showRunModes():
+    modes = []
+    if macroMode:
+        modes.append('macro')
+    if decider != None:
+        modes.append('deciders')
+    if processMode:
+        modes.append('process')
+    if trace != None:
+        modes.append('tracing')
+    if machine.hits != None:
+        modes.append('profiling')
+    if RUN_SPEEDS[speedIndex] != None:
+        modes.append('{0:,} steps/s'.format(RUN_SPEEDS[speedIndex]))
+    if modes:
+        pygame.display.set_caption('TMD-3 (' + ', '.join(modes) + ')')
+    else:
+        pygame.display.set_caption('TMD-3')
+
+# Switch RUN between the plain and the macro machine simulation.
+def toggleMacroMode():
+    global macroMode
+    macroMode = not macroMode
+    showRunModes()
+
+# Make RUN faster or slower by delta steps through RUN_SPEEDS.
+def changeSpeed(delta):
+    global speedIndex
+    speedIndex = min(len(RUN_SPEEDS) - 1, max(0, speedIndex + delta))
+    showRunModes()
+
+# Switch RUN between a worker thread and a worker process. Worker processes
+# need fork, as any other start method would import this module again and open
+# a second window.
+def toggleProcessMode():
+    global processMode
+    if tmd3Worker.PROCESS_CONTEXT.get_start_method() != 'fork':
+        return
+    processMode = not processMode
+    showRunModes()
+
+# Switch the non-halting deciders on or off for RUN.
+def toggleDeciders():
+    global decider
+    if decider == None:
+        decider = tmd3Decider.CycleDecider()
+    else:
+        decider = None
+    showRunModes()
+
+# Start recording a trace to a file asked for in a dialog, or stop recording.
+def toggleTrace():
+    global trace
+    if worker != None:
+        return
+    if trace != None:
+        trace.close()
+        trace = None
+    else:
+        dialog = Dialog(screen, 'Trace', 'Enter the name of the file to record the trace to then press OK.', ['OK', 'CANCEL'], panelLabelFont, True)
+        buttonPressed, filename = dialog.run()
+        # Clear the events queue.
+        pygame.event.clear()
+        if buttonPressed == 'OK' and filename != None:
+            try:
+                trace = tmd3Trace.TraceRecorder(filename, machine.stateTable)
+            except Exception as ex:
+                showErrorMessage(ex)
+    showRunModes()
+
+# Start counting how often each transition fires and show the counts as a heat
+# map over the state transition table, or stop counting.
+def toggleProfile():
+    if worker != None:
+        return
+    if machine.hits != None:
+        machine.stopProfile()
+    else:
+        machine.startProfile()
+    drawHeatMap()
+    showRunModes()
+
+# Show or hide the throughput HUD.
+def toggleHud():
+    global hudShown
+    hudShown = not hudShown
+    drawHud()
+
+# Draw the throughput counters, or blank them out if the HUD is hidden.
+def drawHud():
+    global lastHudTime
+    lastHudTime = time.perf_counter()
+    screen.fill(WHITE, pygame.Rect(HUD_START_X, HUD_START_Y, HUD_WIDTH, HUD_HEIGHT))
+    if not hudShown:
+        return
+    metrics = machine.getMetrics()
+    lines = ['Steps: {0:,}  ({1:,.0f}/s)'.format(metrics['steps'], metrics['stepsPerSecond'])]
+    pollTime = metrics['pollTime'] * 1000 / max(1, metrics['polls'])
+    renderTime = metrics['renderTime'] * 1000 / max(1, metrics['frames'])
+    lines.append('Poll: {0:.2f} ms  Render: {1:.2f} ms'.format(pollTime, renderTime))
+    if metrics['haltLatency'] == None:
+        line = 'Halt latency: -'
+    else:
+        line = 'Halt latency: {0:.0f} ms'.format(metrics['haltLatency'] * 1000)
+    sigma = machine.getSigma()
+    if worker != None:
+        sigma = progressSigma
+    lines.append(line + '  Sigma: {0:,}'.format(sigma))
+    for row, line in enumerate(lines):
+        screen.blit(hudFont.render(line, True, DARK_PURPLE, WHITE), (HUD_START_X, HUD_START_Y + row * HUD_LINE_HEIGHT))
+
+# Show the changes to the screen, redrawing the HUD if it is due, and add the
+# time taken to the render counter.
+def updateDisplay():
+    start = time.perf_counter()
+    if hudShown and start - lastHudTime >= HUD_INTERVAL:
+        drawHud()
+    pygame.display.flip()
+    machine.metrics.addRender(time.perf_counter() - start)
+
 # Handle the demo radio button mouse press.     
 def pushButtonDemo(button):
     global runState
@@ -967,8 +1081,10 @@ def pushButtonDemo(button):
 
 # Draw the symbol from the tape at tapePosition to the screen at cellPosition.
 def drawTapeCell(tapePosition, cellPosition):
-    # Draw the symbol at the tape position passed.
-    symbol = tape[tapePosition]
+    drawTapeSymbol(machine.tape[tapePosition], tapePosition-machine.tapeOrigin, cellPosition)
+
+# Draw the symbol and cell number passed at the cell position on the screen.
+def drawTapeSymbol(symbol, cellNumber, cellPosition):
     symbolImage = cellSymbols[symbol]
     screen.blit(symbolImage, 
                 (int((TAPE_START_X + cellPosition * TAPE_CELL_WIDTH) + (TAPE_CELL_WIDTH - symbolImage.get_width())/2), 
@@ -976,7 +1092,7 @@ def drawTapeCell(tapePosition, cellPosition):
     # Create a cell number.
     numberPanel = pygame.Surface((40,12))
     numberPanel.fill(WHITE)
-    numberText = cellNumberFont.render(str(tapePosition-int(TAPE_NUMBER_CELLS/2)), True, BLACK, WHITE)
+    numberText = cellNumberFont.render(str(cellNumber), True, BLACK, WHITE)
     numberPanel.blit(numberText, (0,0))
     screen.blit(numberPanel, (TAPE_START_X + cellPosition * TAPE_CELL_WIDTH + 5, TAPE_START_Y + 5))
 
@@ -993,58 +1109,203 @@ def showButton(button, highlight=False):
 def drawTape():
     # Show the tape characters.
     cellPosition = 0;
-    for i in range(tapeHead-int(TAPE_CELLS/2),tapeHead+int(TAPE_CELLS/2)+1):
+    for i in range(machine.tapeHead-int(TAPE_CELLS/2),machine.tapeHead+int(TAPE_CELLS/2)+1):
         drawTapeCell(i, cellPosition)
         cellPosition+=1
 
-# Run length encode the tape for saving.
-def encodeTape():
-    compressed = ''
-    start = 0
-    cell = tape[0]
-    for pos in range(1, TAPE_NUMBER_CELLS):
-        if tape[pos] != cell or pos == TAPE_NUMBER_CELLS-1:
-            count = pos - start
-            if count > 5:
-                compressed += '[' + str(count) + ']' + str(cell)
-            else:
-                for i in range(start, pos):
-                    compressed += str(tape[i])
-            start = pos
-            cell = tape[pos]
-    return compressed      
-
-# Decode the run length encoding passed into the tape.
-def decodeTape(compressed):
-    tapePos = 0
-    pos =  0 
-    while pos < len(compressed):
-        if compressed[pos] == '[':
-            pos += 1
-            countStr = ''
-            while compressed[pos] != ']': 
-                countStr += compressed[pos]
-                pos += 1
-            pos += 1
-            count = int(countStr)
-            while count > 0:
-                tape[tapePos] = int(compressed[pos])
-                tapePos += 1
-                count -= 1
-            pos += 1
-        else:
-            tape[tapePos] = int(compressed[pos])
-            tapePos += 1
-            pos += 1
-        
-# Set the tape to all blanks (0).
-def clearTape():
-    # 0 will be the blank character.
-    global tape
-    global tapeHead
-    for i in range(0, TAPE_NUMBER_CELLS):
-        tape[i] = 0
-    tapeHead = int(TAPE_NUMBER_CELLS / 2) 
+# Draw the step count passed above the reset and halt buttons.
+def drawStepCounter(steps):
+    screen.fill(WHITE, pygame.Rect(STEPS_START_X, STEPS_START_Y, STEPS_WIDTH, STEPS_HEIGHT))
+    screen.blit(panelLabelFont.render('Steps: {0:,}'.format(steps), True, PURPLE, WHITE), (STEPS_START_X, STEPS_START_Y))
+
+# Draw the progress published by the worker: the tape around the head, the
+# current state highlighted and the step counter. Its sigma is kept for the HUD.
+def drawProgress(progress):
+    global progressState
+    global progressSigma
+    progressSigma = progress.sigma
+    half = int(TAPE_CELLS/2)
+    for cellPosition in range(TAPE_CELLS):
+        drawTapeSymbol(progress.cells[cellPosition], progress.cell - half + cellPosition, cellPosition)
+    if progress.state != progressState:
+        if progressState != None:
+            drawPanelState(progressState)
+        drawPanelState(progress.state, True)
+        progressState = progress.state
+    drawStepCounter(progress.steps)
+
+# Start running the machine in the background worker, for at most maxSteps
+# transitions.
+def startWorker(maxSteps=None):
+    global worker
+    global progressState
+    global progressSigma
+    if trace != None:
+        worker = tmd3Worker.RunWorker(machine, False, decider, maxSteps, trace)
+    elif machine.hits != None and processMode:
+        worker = tmd3Worker.ProcessRunWorker(machine, False, decider, maxSteps)
+    elif machine.hits != None:
+        worker = tmd3Worker.RunWorker(machine, False, decider, maxSteps)
+    elif processMode:
+        worker = tmd3Worker.ProcessRunWorker(machine, macroMode, decider, maxSteps)
+    else:
+        worker = tmd3Worker.RunWorker(machine, macroMode, decider, maxSteps)
+    progressState = None
+    progressSigma = machine.getSigma()
+    journal.dropPending()
+    worker.start()
+
+# Wait for the worker to stop and return its RunResult. The state highlighted
+# while it ran is set back to normal.
+def finishWorker():
+    global worker
+    global progressState
+    result = worker.finish()
+    worker = None
+    clearProgress()
+    drawStepCounter(machine.steps)
+    return result
+
+# Set the state highlighted while running back to normal.
+def clearProgress():
+    global progressState
+    if progressState != None:
+        drawPanelState(progressState)
+        progressState = None
+
+# Show why a run stopped and halt the state machine. A fast forward that made
+# all of its steps lands in STEP mode at the READ step instead.
+def finishRun(result):
+    global fastForwarding
+    if result.reason == 'undefined':
+        showStateTableError()
+    elif result.reason == 'non-halting':
+        showNonHaltingMessage(result.certificate)
+    if fastForwarding and result.reason == 'budget':
+        landInStepMode()
+    else:
+        haltStateMachine()
+    fastForwarding = False
+    drawHeatMap()
+    if hudShown:
+        drawHud()
+
+# Make as many transitions as the RUN speed allows for the seconds passed, then
+# show where the machine is up to. Returns the RunResult. The deciders are not
+# used, as they need one unbroken run to find a cycle.
+def runAtSpeed(seconds):
+    global speedCredit
+    speed = RUN_SPEEDS[speedIndex]
+    speedCredit = min(speedCredit + speed * seconds, max(1.0, speed * SPEED_MAX_LAG))
+    steps = int(speedCredit)
+    speedCredit -= steps
+    journal.dropPending()
+    result = machine.runFast(None, None, steps, trace=trace)
+    drawProgress(tmd3Worker.machineProgress(machine))
+    if machine.hits != None:
+        drawHeatMap()
+    return result
+
+# Ask for a number of steps in a dialog. Returns None if it was cancelled or
+# is not a number. The file name remembered by the dialog is left alone.
+def askSteps(title, message):
+    global lastFilename
+    filename = lastFilename
+    lastFilename = ''
+    dialog = Dialog(screen, title, message, ['OK', 'CANCEL'], panelLabelFont, True)
+    buttonPressed, text = dialog.run()
+    lastFilename = filename
+    pygame.event.clear()
+    if buttonPressed != 'OK' or text == None:
+        return None
+    try:
+        return int(text.replace(',', ''))
+    except ValueError:
+        return None
+
+# Run the machine on by a number of steps, or up to a step if toStep is True,
+# in the background worker. It lands in STEP mode at the READ step.
+def fastForward(toStep):
+    global stateMachineRunning
+    global fastForwarding
+    if worker != None:
+        return
+    if machine.currentStep != 'READ':
+        dialog = Dialog(screen, 'Fast forward', 'Step on to READ before fast forwarding.', ['OK'], panelLabelFont, False)
+        dialog.run()
+        return
+    if toStep:
+        steps = askSteps('Fast forward', 'Enter the step to stop at then press OK.')
+    else:
+        steps = askSteps('Fast forward', 'Enter the number of steps to run then press OK.')
+    if steps == None:
+        return
+    if toStep:
+        steps -= machine.steps
+    if steps <= 0:
+        return
+
+    # Take down the highlights of a step in progress.
+    resetPanelLabels()
+    showButton(downArrowButton)
+    setRunningMode()
+    stateMachineRunning = True
+    fastForwarding = True
+    startWorker(steps)
+
+# Switch to STEP mode with the machine waiting at its READ step.
+def landInStepMode():
+    global stepReady
+    global playPressed
+    pushButtonStep(None)
+    clearProgress()
+    drawTape()
+    setRunningMode()
+    stepReady = False
+    playPressed = False
+
+# Go back one transition with the undo journal, or back to the READ step of a
+# transition part way through. The machine is left in STEP mode.
+def stepBackward():
+    if worker != None or (runState == 'RUN' and stateMachineRunning):
+        return
+    resetPanelLabels()
+    if journal.stepBack(machine):
+        showStepped()
+
+# Rewind to a step asked for in a dialog, with the undo journal. The machine is
+# left in STEP mode at the READ step.
+def rewindToStep():
+    if worker != None or (runState == 'RUN' and stateMachineRunning):
+        return
+    step = askSteps('Rewind', 'Enter the step to go back to then press OK.')
+    if step == None:
+        return
+    resetPanelLabels()
+    if not journal.rewind(machine, step):
+        dialog = Dialog(screen, 'Rewind', 'Can only go back to a step before this one, from the READ step.', ['OK'], panelLabelFont, False)
+        dialog.run()
+        return
+    showStepped()
+
+# Show the machine after stepping back and wait at its READ step in STEP mode.
+def showStepped():
+    global stateMachineRunning
+    redrawStateTable()
+    showButton(downArrowButton)
+    showButton(leftArrowButton)
+    showButton(rightArrowButton)
+    landInStepMode()
+    drawStepCounter(machine.steps)
+    stateMachineRunning = True
+
+# Stop the worker if it is running and finish the trace, before quitting.
+def stopWorker():
+    if worker != None:
+        worker.halt()
+        worker.finish()
+    if trace != None:
+        trace.close()
 
 # Set the play button to normal and the halt button to halted (red).
 def setHaltedMode():
@@ -1065,6 +1326,7 @@ def haltStateMachine():
     
     # Play normal, halt highlighted. 
     setHaltedMode()
+    clearProgress()
     
     # Redraw the tape if necessary.
     if runState == 'RUN':
@@ -1160,31 +1422,45 @@ def drawStateSymbol(state, row, column, symbol, highlight=False):
                 (int(startX + (PANEL_CELL_WIDTH + PANEL_BORDER_WIDTH)*column + PANEL_CELL_WIDTH/2 - symbolImage.get_width()/3.5), 
                  int(startY + (PANEL_CELL_HEIGHT + PANEL_BORDER_WIDTH)*row + PANEL_CELL_HEIGHT/2 - 2 - symbolImage.get_height()/3.5)))
 
-# Set the state transition table data structure to default values.
-def clearStateTable():
-    for state in ('A', 'B', 'C', 'D', 'E', 'F'):
-        for value in ('0', '1', '2', '3', '4'):
-            if value == '4':
-                stateTable[state+value] = [' ', ' ', ' ', ' ']
-            else:
-                stateTable[state+value] = [value, ' ', ' ', ' ']
-    currentTransition = None
-
 # Draw the symbols from the state transition table structure to the screen.  
 def redrawStateTable():
     for state in ('A', 'B', 'C', 'D', 'E', 'F'):
         for value in ('0', '1', '2', '3', '4'):
-            drawStateSymbol(state, 1, int(value), stateTable[state+value][0])
-            drawStateSymbol(state, 2, int(value), stateTable[state+value][1])
-            drawStateSymbol(state, 3, int(value), stateTable[state+value][2])
-            drawStateSymbol(state, 4, int(value), stateTable[state+value][3])
+            drawStateSymbol(state, 1, int(value), machine.stateTable[state+value][0])
+            drawStateSymbol(state, 2, int(value), machine.stateTable[state+value][1])
+            drawStateSymbol(state, 3, int(value), machine.stateTable[state+value][2])
+            drawStateSymbol(state, 4, int(value), machine.stateTable[state+value][3])
+    if machine.hits != None:
+        drawHeatMap()
+
+# Tint each state transition table column by how often it has fired while
+# profiling, from white for never to red for the most, on a log scale. When not
+# profiling the tint is taken off.
+def drawHeatMap():
+    hits = machine.getHits()
+    most = 0.0
+    if hits != None:
+        most = math.log1p(max(hits.values()))
+    for state in ('A', 'B', 'C', 'D', 'E', 'F'):
+        startX,startY,_,_ = statePanelOffsets[state]
+        for col in range(0, PANEL_COLUMNS):
+            cell = pygame.Rect(startX + (PANEL_CELL_WIDTH + PANEL_BORDER_WIDTH)*col + 1,
+                               startY + (PANEL_CELL_HEIGHT + PANEL_BORDER_WIDTH) + 1,
+                               PANEL_CELL_WIDTH - 1,
+                               (PANEL_CELL_HEIGHT + PANEL_BORDER_WIDTH)*(PANEL_ROWS-1) - PANEL_BORDER_WIDTH - 1)
+            screen.fill(WHITE, cell)
+            for row in range(1, PANEL_ROWS):
+                drawStateSymbol(state, row, col, machine.stateTable[state+str(col)][row-1])
+            if most > 0:
+                heat = math.log1p(hits[state+str(col)]) / most
+                screen.fill((255, int(255 - 135*heat), int(255 - 255*heat)), cell, special_flags=pygame.BLEND_MULT)
 
 # Show the active transition column of the state table.
 def highlightTransition(state, transition):
     if transition[0] == 'b':
         col = 5
     else:
-        col = int(currentTransition[0])
+        col = int(machine.currentTransition[0])
     drawStateSymbol(state, 1, col, transition[0], True)
     drawStateSymbol(state, 2, col, transition[1], True)
     drawStateSymbol(state, 3, col, transition[2], True)
@@ -1192,98 +1468,30 @@ def highlightTransition(state, transition):
     
 # Show the transition not defined error.
 def showStateTableError():
-    msg = 'Transition ' + currentState + currentTransition[0] + ' is not defined. Resetting to start state.'
+    msg = 'Transition ' + machine.currentState + machine.currentTransition[0] + ' is not defined. Resetting to start state.'
     dialog = Dialog(screen, 'Warning', msg, ['OK'], panelLabelFont, False)
                     
     answer = dialog.run()
 
     # Clear the events queue.
     if answer == 'YES':
-        clearStateTable()
+        machine.clearStateTable()
     redrawStateTable() 
     
-def runFast():
-    global tape
-    global tapeHead
-    global stateTable
-    global currentTransition
-    global currentState
-    global currentStep
-    global lastMoveDirection
-    
-    # Check halt button for mouse over.
-    buttons = []
-    buttons.append(haltButton)
-           
-    # Pre-compute boundary conditions.
-    LEFT_STOP = int(TAPE_CELLS/2) + 1
-    RIGHT_STOP = TAPE_NUMBER_CELLS - int(TAPE_CELLS/2) - 1
-
-    loops = 0
-    while True:   
-        # Read
-        value = tape[tapeHead]
-        if value == 5:
-            currentTransition = stateTable[currentState+'4']
-        else:
-            currentTransition = stateTable[currentState+str(value)]
-        
-        # Check for invalid state transition table.  
-        if currentTransition[1] == ' ' or currentTransition[2] == ' ' or currentTransition[3] == ' ':
-            currentStep = 'READ'
-            return 'E'
-        
-        # Write. Do not write over a 'b'.
-        if currentTransition[1] != 'b':
-            tape[tapeHead] = int(currentTransition[1])
-            
-        # Move. Check for boundary conditions.
-        if currentTransition[0] == 'b' and currentTransition[2] == lastMoveDirection:
-            # Cannot go past a boundary.
-            currentStep = 'MOVE'
-            return 'H'
-        
-        if currentTransition[2] != 'R':
-            if tapeHead < RIGHT_STOP:
-                tapeHead += 1
-            else:
-                # Out of bounds.
-                currentStep = 'MOVE'
-                return 'H'
-        else:
-            if tapeHead > LEFT_STOP:
-                tapeHead -= 1
-            else:
-                # Out of bounds.
-                currentStep = 'MOVE'
-                return 'H'
-        
-        # Goto. Set the new state.
-        if currentTransition[3] == 'H':
-            currentStep = 'GOTO'
-            return 'H'
-        else:
-            currentState = currentTransition[3]
-        
-        # Periodically check for mouse events.
-        loops += 1;
-        if loops % 100000 == 0:
-                
-            # See if any button needs to be highlighted.
-            if checkForMouseovers(buttons):
-                pygame.display.flip()
-            
-            # Watch for the halt button pressed.
-            for event in pygame.event.get():
-                if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and haltButton["rect"].collidepoint(event.pos):
-                    currentTransition = None
-                    currentStep = 'READ'
-                    return 'H'
-                
+# Show the proof passed that the machine never halts.
+def showNonHaltingMessage(certificate):
+    if certificate['decider'] == 'cycler':
+        msg = 'The machine repeats itself every {0} steps, first at step {1}. It will never halt.'.format(certificate['period'], certificate['step'])
+    else:
+        msg = 'The machine repeats itself every {0} steps shifted {1} cells, first at step {2}. It will never halt.'.format(certificate['period'], certificate['offset'], certificate['step'])
+    dialog = Dialog(screen, 'Non-halting', msg, ['OK'], panelLabelFont, False)
+    dialog.run()
+
 # Scan the panel for the state passed to see if any tiles have changed.
 def checkPanelForTiles(state, sensors, channel):
     # Do not allow the tape or state cells to be modified while running.
     if not stateMachineRunning and hasHardware:
+        changed = False
         # Check to see if a tile has been changed.
         for i in range(0,16):
             col =  cols[i]-1
@@ -1297,37 +1505,42 @@ def checkPanelForTiles(state, sensors, channel):
                 for tile in sensors[i]["tiles"]:
                     if abs(tile[0]-val) < 60:
                         # Special case for 'b'.
-                        if row == 2 and col == 4 and stateTable[state+str(col)][row-1] == 'b':
+                        if row == 2 and col == 4 and machine.stateTable[state+str(col)][row-1] == 'b':
                             # Can't overwrite a 'b'.
                             tileMatched = True
                             break
                         # Tiles matched.  Set the value.
                         value = tile[1]
-                        stateTable[state+str(col)][row-1] = value
+                        machine.stateTable[state+str(col)][row-1] = value
                         drawStateSymbol(state, row, col, value)
                         sensors[i]["set"] = True
                         tileMatched = True
+                        changed = True
                         # Special case for 'b'.
                         if row == 1 and col == 4 and value == 'b':
-                            stateTable[state+str(col)][1] = value
+                            machine.stateTable[state+str(col)][1] = value
                             drawStateSymbol(state, 2, 4, value)
                 if not tileMatched:
                     # Wrong tile for row.
                     value = "?"
-                    stateTable[state+str(col)][row-1] = value
+                    machine.stateTable[state+str(col)][row-1] = value
                     drawStateSymbol(state, row, col, value)
                     sensors[i]["set"] = True
+                    changed = True
             else:
                 # Clear tile if was set by by adding a tile.
                 if sensors[i]["set"] == True:
                     value = " "
-                    stateTable[state+str(col)][row-1] = value
+                    machine.stateTable[state+str(col)][row-1] = value
                     drawStateSymbol(state, row, col, value)
                     sensors[i]["set"] = False
+                    changed = True
                     # Special case for 'b'.
                     if row == 1 and col == 4:
-                        stateTable[state+str(col)][1] = value
+                        machine.stateTable[state+str(col)][1] = value
                         drawStateSymbol(state, 2, 4, value)
+        if changed:
+            machineEdited()
                 
 ##### Screen setup.          
 # Draw the tape frame.
@@ -1339,7 +1552,7 @@ for x in range(TAPE_CELLS-1):
                      ((x+1)*TAPE_CELL_WIDTH+TAPE_START_X, TAPE_CELL_HEIGHT+TAPE_START_Y-1), 
                      TAPE_BORDER_WIDTH)
 # Show the tape characters
-clearTape()
+machine.clearTape()
 drawTape()
     
 # Create and draw the tape controls. Left arrow.
@@ -1507,332 +1720,366 @@ drawStatePanel(PANEL_START_X + PANEL_WIDTH, PANEL_START_Y + PANEL_HEIGHT, 'E')
 drawStatePanel(PANEL_START_X + PANEL_WIDTH * 2, PANEL_START_Y + PANEL_HEIGHT, 'F')
 
 # Show the default panel symbols.
-clearStateTable()
+machine.clearStateTable()
 redrawStateTable()
+machineEdited()
 
 # Set the keyboard repeat rate to something reasonable.
 pygame.key.set_repeat(1000, 25) 
 
 ##### Main loop.
-# Process the PyGame events.
-done = False
-while not done:
-    # Check the event queue. 
-    for event in pygame.event.get():
-        if event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_ESCAPE:
+# Run the console when started as a script (the benchmarks import this module).
+if __name__ == '__main__':
+    # Process the PyGame events.
+    done = False
+    while not done:
+        # Check the event queue. 
+        for event in pygame.event.get():
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    stopWorker()
+                    pygame.quit()
+                    done = True
+                elif event.key == pygame.K_LEFT and worker == None:
+                    pushButtonLeft(None)
+                elif event.key == pygame.K_RIGHT and worker == None:
+                    pushButtonRight(None)
+                elif event.key == pygame.K_m:
+                    toggleMacroMode()
+                elif event.key == pygame.K_d:
+                    toggleDeciders()
+                elif event.key == pygame.K_h:
+                    toggleHud()
+                elif event.key == pygame.K_p:
+                    toggleProcessMode()
+                elif event.key in (pygame.K_EQUALS, pygame.K_PLUS, pygame.K_KP_PLUS):
+                    changeSpeed(1)
+                elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                    changeSpeed(-1)
+                elif event.key == pygame.K_f:
+                    fastForward(False)
+                elif event.key == pygame.K_g:
+                    fastForward(True)
+                elif event.key == pygame.K_BACKSPACE:
+                    stepBackward()
+                elif event.key == pygame.K_k:
+                    rewindToStep()
+                elif event.key == pygame.K_t:
+                    toggleTrace()
+                elif event.key == pygame.K_c:
+                    toggleProfile()
+            elif event.type == pygame.QUIT:
+                stopWorker()
                 pygame.quit()
                 done = True
-            elif event.key == pygame.K_LEFT:
-                pushButtonLeft(None)
-            elif event.key == pygame.K_RIGHT:
-                pushButtonRight(None)
-        elif event.type == pygame.QUIT:
-            pygame.quit()
-            done = True
-        elif event.type == TIMEREVENT:
-            if runState == 'DEMO':
-                playPressed = True
-        elif event.type == pygame.MOUSEBUTTONDOWN:
+            elif event.type == TIMEREVENT:
+                if runState == 'DEMO':
+                    playPressed = True
+            elif event.type == pygame.MOUSEBUTTONDOWN and worker != None:
+                # Only HALT works while the worker is running.
+                buttonOnClick(haltButton, event)
+            elif event.type == pygame.MOUSEBUTTONDOWN:
             
-            # First check all the buttons.
-            buttonOnClick(leftArrowButton, event)
-            buttonOnClick(rightArrowButton, event)
-            buttonOnClick(downArrowButton, event)
-            buttonOnClick(resetButton, event)
-            buttonOnClick(haltButton, event)
-            buttonOnClick(playButton, event)
-            buttonOnClick(runButton, event)
-            buttonOnClick(stepButton, event)
-            buttonOnClick(demoButton, event)
-            buttonOnClick(loadButton, event)
-            buttonOnClick(saveButton, event)
-            buttonOnClick(exitButton, event)
+                # First check all the buttons.
+                buttonOnClick(leftArrowButton, event)
+                buttonOnClick(rightArrowButton, event)
+                buttonOnClick(downArrowButton, event)
+                buttonOnClick(resetButton, event)
+                buttonOnClick(haltButton, event)
+                buttonOnClick(playButton, event)
+                buttonOnClick(runButton, event)
+                buttonOnClick(stepButton, event)
+                buttonOnClick(demoButton, event)
+                buttonOnClick(loadButton, event)
+                buttonOnClick(saveButton, event)
+                buttonOnClick(exitButton, event)
        
-            # Do not allow the tape or state cells to be modified while running.
-            if not stateMachineRunning:
-                # Check to see if a tape cell has been clicked.
-                if tapeBorder.collidepoint(event.pos):
-                    # Determine which cell.
-                    cellPosition = int((event.pos[0] - TAPE_START_X) / TAPE_CELL_WIDTH)
-                    # Find the cell position on the tape.
-                    tapePosition = tapeHead - int(TAPE_CELLS/2) + cellPosition
+                # Do not allow the tape or state cells to be modified while running.
+                if not stateMachineRunning:
+                    # Check to see if a tape cell has been clicked.
+                    if tapeBorder.collidepoint(event.pos):
+                        # Determine which cell.
+                        cellPosition = int((event.pos[0] - TAPE_START_X) / TAPE_CELL_WIDTH)
+                        # Find the cell position on the tape.
+                        tapePosition = machine.tapeHead - int(TAPE_CELLS/2) + cellPosition
                     
-                    # Check for scroll wheel event.
-                    if event.button == 4 or event.button == 5:
-                        # 4 means scrolling up 5 means scrolling down.
-                        positionY = event.button - 4
-                    else :
-                        # See if the y position is in the upper or lower part of the cell.
-                        positionY = int((event.pos[1] - TAPE_START_Y) / (TAPE_CELL_HEIGHT/2))
+                        # Check for scroll wheel event.
+                        if event.button == 4 or event.button == 5:
+                            # 4 means scrolling up 5 means scrolling down.
+                            positionY = event.button - 4
+                        else :
+                            # See if the y position is in the upper or lower part of the cell.
+                            positionY = int((event.pos[1] - TAPE_START_Y) / (TAPE_CELL_HEIGHT/2))
                         
-                    if positionY == 0:
-                        tape[tapePosition] = (tape[tapePosition] - 1) % 6;
-                    else:
-                        tape[tapePosition] = (tape[tapePosition] + 1) % 6;
-                    drawTapeCell(tapePosition, cellPosition)
+                        if positionY == 0:
+                            machine.writeCell(tapePosition, (machine.tape[tapePosition] - 1) % 6)
+                        else:
+                            machine.writeCell(tapePosition, (machine.tape[tapePosition] + 1) % 6)
+                        drawTapeCell(tapePosition, cellPosition)
+                        machineEdited()
                     
-                # Check to see if a state table cell has been clicked.
-                for state in statePanelOffsets:
-                    # Check each panel.
-                    panelBounds = statePanelOffsets[state]
-                    if panelBounds.collidepoint(event.pos):
-                        # Found clicked panel, find out which cell.
-                        col = int((event.pos[0] - panelBounds[0])/(PANEL_CELL_WIDTH+PANEL_BORDER_WIDTH))
-                        row = int((event.pos[1] - panelBounds[1])/(PANEL_CELL_HEIGHT+PANEL_BORDER_WIDTH))
+                    # Check to see if a state table cell has been clicked.
+                    for state in statePanelOffsets:
+                        # Check each panel.
+                        panelBounds = statePanelOffsets[state]
+                        if panelBounds.collidepoint(event.pos):
+                            # Found clicked panel, find out which cell.
+                            col = int((event.pos[0] - panelBounds[0])/(PANEL_CELL_WIDTH+PANEL_BORDER_WIDTH))
+                            row = int((event.pos[1] - panelBounds[1])/(PANEL_CELL_HEIGHT+PANEL_BORDER_WIDTH))
                         
-                        # Determine if event in upper or lower part of cell.
-                        top = panelBounds[1]+(PANEL_CELL_HEIGHT+PANEL_BORDER_WIDTH)*(row)
-                        bottom = top + PANEL_CELL_HEIGHT
-                        middle = int((top + bottom) / 2)
+                            # Determine if event in upper or lower part of cell.
+                            top = panelBounds[1]+(PANEL_CELL_HEIGHT+PANEL_BORDER_WIDTH)*(row)
+                            bottom = top + PANEL_CELL_HEIGHT
+                            middle = int((top + bottom) / 2)
                         
-                        # If upper decrease the cell value, otherwise increase the cell value.
-                        # Also check for mouse wheel events.
-                        if event.button == 4:
-                            offset =-1
-                        elif event.button == 5:
-                            offset = 1
-                        elif event.pos[1] < middle:
-                            offset = -1
-                        else: 
-                            offset = 1
+                            # If upper decrease the cell value, otherwise increase the cell value.
+                            # Also check for mouse wheel events.
+                            if event.button == 4:
+                                offset =-1
+                            elif event.button == 5:
+                                offset = 1
+                            elif event.pos[1] < middle:
+                                offset = -1
+                            else: 
+                                offset = 1
                       
-                        # Read symbols. Only the last column can be changed in the read row.
-                        if row == 1 and col == 4:
-                            value = stateTable[state+str(col)][0]
-                            size = len(readSymbols)
-                            pos = readSymbols.index(value)
-                            index = (pos+offset) % size
-                            value = readSymbols[index]
-                            stateTable[state+str(col)][0] = value
-                            drawStateSymbol(state, 1, 4, value) 
-                            # Special case for 'b'.
-                            if value == 'b':
-                                stateTable[state+str(col)][1] = value
-                                drawStateSymbol(state, 2, 4, value) 
-                            else:
-                                stateTable[state+str(col)][1] = ' '
-                                drawStateSymbol(state, 2, 4, ' ') 
-                        elif row == 2:
-                            value = stateTable[state+str(col)][1]
-                            if value != 'b':
-                                size = len(writeSymbols)
-                                pos = writeSymbols.index(value)
+                            # Read symbols. Only the last column can be changed in the read row.
+                            if row == 1 and col == 4:
+                                value = machine.stateTable[state+str(col)][0]
+                                size = len(readSymbols)
+                                pos = readSymbols.index(value)
+                                index = (pos+offset) % size
+                                value = readSymbols[index]
+                                machine.stateTable[state+str(col)][0] = value
+                                drawStateSymbol(state, 1, 4, value) 
+                                # Special case for 'b'.
+                                if value == 'b':
+                                    machine.stateTable[state+str(col)][1] = value
+                                    drawStateSymbol(state, 2, 4, value) 
+                                else:
+                                    machine.stateTable[state+str(col)][1] = ' '
+                                    drawStateSymbol(state, 2, 4, ' ') 
+                            elif row == 2:
+                                value = machine.stateTable[state+str(col)][1]
+                                if value != 'b':
+                                    size = len(writeSymbols)
+                                    pos = writeSymbols.index(value)
+                                    index = (pos+offset) % size
+                                    value = writeSymbols[index]
+                                    machine.stateTable[state+str(col)][1] = value
+                                    drawStateSymbol(state, 2, col, value)
+                            elif row == 3:
+                                value = machine.stateTable[state+str(col)][2]
+                                size = len(moveSymbols)
+                                pos = moveSymbols.index(value)
                                 index = (pos+offset) % size
-                                value = writeSymbols[index]
-                                stateTable[state+str(col)][1] = value
-                                drawStateSymbol(state, 2, col, value)
-                        elif row == 3:
-                            value = stateTable[state+str(col)][2]
-                            size = len(moveSymbols)
-                            pos = moveSymbols.index(value)
-                            index = (pos+offset) % size
-                            value = moveSymbols[index]
-                            stateTable[state+str(col)][2] = value
-                            drawStateSymbol(state, 3, col, value) 
-                        elif row == 4:
-                            value = stateTable[state+str(col)][3]
-                            size = len(gotoSymbols)
-                            pos = gotoSymbols.index(value)
-                            index = (pos+offset) % size
-                            value = gotoSymbols[index]
-                            stateTable[state+str(col)][3] = value
-                            drawStateSymbol(state, 4, col, value)
+                                value = moveSymbols[index]
+                                machine.stateTable[state+str(col)][2] = value
+                                drawStateSymbol(state, 3, col, value) 
+                            elif row == 4:
+                                value = machine.stateTable[state+str(col)][3]
+                                size = len(gotoSymbols)
+                                pos = gotoSymbols.index(value)
+                                index = (pos+offset) % size
+                                value = gotoSymbols[index]
+                                machine.stateTable[state+str(col)][3] = value
+                                drawStateSymbol(state, 4, col, value)
+                            machineEdited()
         
-    if done:
-        break # Break out of the while loop.
-
-    # Check for tile changes.
-    if hasHardware:
-        checkPanelForTiles("C", sensors[0], chan0)
-        checkPanelForTiles("B", sensors[1], chan1)
-        checkPanelForTiles("A", sensors[2], chan2)
-        checkPanelForTiles("D", sensors[3], chan3)
-        checkPanelForTiles("E", sensors[4], chan4)
-        checkPanelForTiles("F", sensors[5], chan5)
+        if done:
+            break # Break out of the while loop.
+
+        # Check for tile changes.
+        if hasHardware and worker == None:
+            checkPanelForTiles("C", sensors[0], chan0)
+            checkPanelForTiles("B", sensors[1], chan1)
+            checkPanelForTiles("A", sensors[2], chan2)
+            checkPanelForTiles("D", sensors[3], chan3)
+            checkPanelForTiles("E", sensors[4], chan4)
+            checkPanelForTiles("F", sensors[5], chan5)
     
-    # Highlight any buttons the mouse is over.
-    checkForMouseovers(buttons)
+        # Highlight any buttons the mouse is over.
+        checkForMouseovers(buttons)
                 
-    # Don't start running the state machine until play pressed.
-    if stateMachineRunning == False:
-        # Show the changes to the screen.
-        pygame.display.flip()
-        continue
+        # Don't start running the state machine until play pressed.
+        if stateMachineRunning == False:
+            # Show the changes to the screen.
+            updateDisplay()
+            continue
     
-    # If RUN use the optimized method. 
-    if runState == 'RUN':
-        # Show the play button in running mode.
-        pygame.display.flip()
-        
-        # Run the optimized state machine.
-        if runFast() == 'E':
-            showStateTableError()
-        haltStateMachine()
-        continue
+        # Show the progress of a run in the background worker until it stops.
+        if worker != None:
+            if not worker.isDone():
+                drawProgress(worker.getProgress())
+                updateDisplay()
+                clock.tick(RUN_FRAME_RATE)
+                continue
+            finishRun(finishWorker())
+            continue
+
+        # If RUN use the optimized method in the background worker, or at a
+        # set speed make a batch of transitions each frame.
+        if runState == 'RUN':
+            if RUN_SPEEDS[speedIndex] == None:
+                # Show the play button in running mode.
+                updateDisplay()
+                startWorker()
+                continue
+            result = runAtSpeed(clock.tick(60) / 1000)
+            if result.reason != 'budget':
+                finishRun(result)
+            updateDisplay()
+            continue
             
-    # Read.
-    if currentStep == 'READ':
-        if stepReady == False:
-            # Highlight the state and read labels.
-            drawPanelLabel(currentState, 'READ', True)
-            drawPanelState(currentState, True)
+        # Read.
+        if machine.currentStep == 'READ':
+            if stepReady == False:
+                # Highlight the state and read labels.
+                drawPanelLabel(machine.currentState, 'READ', True)
+                drawPanelState(machine.currentState, True)
             
-            # Highlight the tape head.
-            showButton(downArrowButton, True)
+                # Highlight the tape head.
+                showButton(downArrowButton, True)
             
-            # Indicate read ready for play press.
-            stepReady = True
-        if playPressed:
-            # Read the symbol at the tape head position and determine the transition tuple.
-            value = tape[tapeHead]
-            if value == 5:
-                currentTransition = stateTable[currentState+'4']
-            else:
-                currentTransition = stateTable[currentState+str(value)]
-                
-            if currentTransition[1] == ' ' or currentTransition[2] == ' ' or currentTransition[3] == ' ':
+                # Indicate read ready for play press.
+                stepReady = True
+            if playPressed:
+                # Read the symbol at the tape head position and determine the transition tuple.
+                journal.begin(machine)
+                if trace != None:
+                    trace.begin(machine)
+                if not machine.readTransition():
                 
-                showStateTableError()
+                    showStateTableError()
                 
-                # Reset to starting state.
-                playPressed = False
-                resetRuntime()
-                setStartingMode()
+                    # Reset to starting state.
+                    playPressed = False
+                    resetRuntime()
+                    setStartingMode()
              
-                continue
+                    continue
                 
-            # Highlight the transition column selected.
-            highlightTransition(currentState, currentTransition)
+                # Highlight the transition column selected.
+                highlightTransition(machine.currentState, machine.currentTransition)
             
-            # Set the READ label to normal.
-            drawPanelLabel(currentState, 'READ')
+                # Set the READ label to normal.
+                drawPanelLabel(machine.currentState, 'READ')
             
-            # Advance to the next step.
-            currentStep = 'WRITE'
-            playPressed = False
-            stepReady = False
+                # Advance to the next step.
+                machine.currentStep = 'WRITE'
+                playPressed = False
+                stepReady = False
             
-    # Write.
-    if currentStep == 'WRITE':
-        if stepReady == False:
-            # Highlight the write label.
-            drawPanelLabel(currentState, 'WRITE', True)  
+        # Write.
+        if machine.currentStep == 'WRITE':
+            if stepReady == False:
+                # Highlight the write label.
+                drawPanelLabel(machine.currentState, 'WRITE', True)  
              
-            # Indicate write ready for play press.
-            stepReady = True
-        if playPressed:
-            # Update the tape with the new value. If is 'b' don't write,
-            if currentTransition[1] != 'b':
-                tape[tapeHead] = int(currentTransition[1])
+                # Indicate write ready for play press.
+                stepReady = True
+            if playPressed:
+                # Update the tape with the new value. If is 'b' don't write,
+                machine.writeSymbol()
                 
-            # Show the updated tape cell.
-            cellPosition = int(TAPE_CELLS/2)
-            drawTapeCell(tapeHead, cellPosition)
+                # Show the updated tape cell.
+                cellPosition = int(TAPE_CELLS/2)
+                drawTapeCell(machine.tapeHead, cellPosition)
               
-            # Set the WRITE label to normal.
-            drawPanelLabel(currentState, 'WRITE')
+                # Set the WRITE label to normal.
+                drawPanelLabel(machine.currentState, 'WRITE')
             
-            # Remove highlight from tape head.
-            showButton(downArrowButton)
+                # Remove highlight from tape head.
+                showButton(downArrowButton)
                 
-            # Advance to the next step.
-            currentStep = 'MOVE'
-            playPressed = False
-            stepReady = False
+                # Advance to the next step.
+                machine.currentStep = 'MOVE'
+                playPressed = False
+                stepReady = False
             
-    # Move.
-    if currentStep == 'MOVE':
-        if stepReady == False:
-            # Highlight the move label.
-            drawPanelLabel(currentState, 'MOVE', True)  
+        # Move.
+        if machine.currentStep == 'MOVE':
+            if stepReady == False:
+                # Highlight the move label.
+                drawPanelLabel(machine.currentState, 'MOVE', True)  
             
-            # Highlight the appropriate tape direction arrow.
-            if currentTransition[2] != 'R':
-                showButton(leftArrowButton, True)
-            else:
-                showButton(rightArrowButton, True)
+                # Highlight the appropriate tape direction arrow.
+                if machine.currentTransition[2] != 'R':
+                    showButton(leftArrowButton, True)
+                else:
+                    showButton(rightArrowButton, True)
              
-            # Indicate write ready for play press.
-            stepReady = True
+                # Indicate write ready for play press.
+                stepReady = True
         
-        if playPressed:
-            # Check for boundary conditions.
-            if currentTransition[0] == 'b' and currentTransition[2] == lastMoveDirection:
-                # Cannot go past a boundary.
-                haltStateMachine()
-            else:  
-                # Move the tape.
-                if currentTransition[2] != 'R':
-                    if tapeHead < TAPE_NUMBER_CELLS - int(TAPE_CELLS/2) - 1:
-                        tapeHead += 1
+            if playPressed:
+                # Check for boundary conditions.
+                if machine.atBoundary():
+                    # Cannot go past a boundary.
+                    haltStateMachine()
+                else:  
+                    # Move the tape and record the move direction.
+                    machine.moveHead()
+                    if machine.currentTransition[2] != 'R':
+                        button = leftArrowButton
                     else:
-                        # Out of bounds.
-                        haltStateMachine()
-                    button = leftArrowButton
-                else:
-                    if tapeHead > int(TAPE_CELLS/2) + 1:
-                        tapeHead -= 1
-                    else:
-                        # Out of bounds.
-                        haltStateMachine()
-                    button = rightArrowButton
+                        button = rightArrowButton
                     
-                # Set the tape arrow button to normal.
-                showButton(button)
+                    # Set the tape arrow button to normal.
+                    showButton(button)
                 
-                # Set the MOVE label to normal.
-                drawPanelLabel(currentState, 'MOVE')
+                    # Set the MOVE label to normal.
+                    drawPanelLabel(machine.currentState, 'MOVE')
                 
-                # Show the updated tape.
-                drawTape()
-                    
-                # Record the last move direction.
-                lastMoveDirection = currentTransition[2]
+                    # Show the updated tape.
+                    drawTape()
                 
-                # Advance to the next step.
-                currentStep = 'GOTO'
-                playPressed = False
-                stepReady = False
+                    # Advance to the next step.
+                    machine.currentStep = 'GOTO'
+                    playPressed = False
+                    stepReady = False
     
-    # Goto.
-    if currentStep == 'GOTO':
-        if stepReady == False:
-            # Highlight the move label.
-            drawPanelLabel(currentState, 'GOTO', True)  
+        # Goto.
+        if machine.currentStep == 'GOTO':
+            if stepReady == False:
+                # Highlight the move label.
+                drawPanelLabel(machine.currentState, 'GOTO', True)  
              
-            # Indicate write ready for play press.
-            stepReady = True
-        if playPressed:
+                # Indicate write ready for play press.
+                stepReady = True
+            if playPressed:
                 
-            # Set the MOVE label and state to normal.
-            drawPanelLabel(currentState, 'GOTO')
-            drawPanelState(currentState)
+                # Set the MOVE label and state to normal.
+                drawPanelLabel(machine.currentState, 'GOTO')
+                drawPanelState(machine.currentState)
             
-            # Set the transition column selected to normal.
-            if currentTransition[0] == 'b':
-                col = 5
-            else:
-                col = int(currentTransition[0])
-            drawStateSymbol(currentState, 1, col, currentTransition[0])
-            drawStateSymbol(currentState, 2, col, currentTransition[1])
-            drawStateSymbol(currentState, 3, col, currentTransition[2])
-            drawStateSymbol(currentState, 4, col, currentTransition[3])
+                # Set the transition column selected to normal.
+                if machine.currentTransition[0] == 'b':
+                    col = 5
+                else:
+                    col = int(machine.currentTransition[0])
+                drawStateSymbol(machine.currentState, 1, col, machine.currentTransition[0])
+                drawStateSymbol(machine.currentState, 2, col, machine.currentTransition[1])
+                drawStateSymbol(machine.currentState, 3, col, machine.currentTransition[2])
+                drawStateSymbol(machine.currentState, 4, col, machine.currentTransition[3])
             
-            # Set the new state.
-            if currentTransition[3] == 'H':
-                haltStateMachine()
-            else:
-                currentState = currentTransition[3]
+                # Set the new state.
+                if not machine.gotoState():
+                    haltStateMachine()
+                if machine.hits != None:
+                    drawHeatMap()
+                journal.commit(machine)
+                if trace != None:
+                    trace.commit(machine)
                 
-            # Clear the current transition.
-            currentTransition = None
+                # Clear the current transition.
+                machine.currentTransition = None
             
-            # Advance to the next step.
-            currentStep = 'READ'
-            playPressed = False
-            stepReady = False
+                # Advance to the next step.
+                machine.currentStep = 'READ'
+                playPressed = False
+                stepReady = False
            
-    # Show the changes to the screen.
-    pygame.display.flip()
-    clock.tick(60)
+        # Show the changes to the screen.
+        updateDisplay()
+        clock.tick(60)
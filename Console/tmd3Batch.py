@@ -0,0 +1,123 @@
+# Command line batch runner for TMD-3 saves.
+#
+# Runs every .tmd3 file in the directories and glob patterns passed across a
+# pool of worker processes, each with a step budget, and writes one summary row
+# per file as CSV or JSON lines. For example:
+#
+#   python tmd3Batch.py saves "beaver*.tmd3" --steps 100000000 --output results.csv
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import tmd3Engine
+import tmd3Macro
+import tmd3Decider
+
+##### Globals
+# Most transitions made for each file unless --steps is given.
+DEFAULT_MAX_STEPS = 100000000
+
+# Columns of the summary, in order.
+FIELDS = ['file', 'reason', 'steps', 'elapsed', 'state', 'head', 'nonblank',
+          '0', '1', '2', '3', '4', 'b', 'certificate', 'error']
+
+##### Functions and classes.
+# Return the .tmd3 files in the directories and glob patterns passed, sorted
+# and without duplicates.
+def findFiles(paths):
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(glob.glob(os.path.join(path, '*.tmd3')))
+        else:
+            files.update(name for name in glob.glob(path) if name.endswith('.tmd3'))
+    return sorted(files)
+
+# Load and run one file. Called in the worker processes with a (filename,
+# settings) tuple, returns the summary row as a dictionary.
+def runFile(job):
+    filename, settings = job
+    row = {'file': filename}
+    try:
+        machine = tmd3Engine.Machine()
+        machine.loadWorkspace(filename[:-len('.tmd3')])
+        decider = None
+        if settings['deciders']:
+            decider = tmd3Decider.CycleDecider()
+        if settings['macro']:
+            result = tmd3Macro.runMacro(machine, decider=decider, maxSteps=settings['steps'], maxTime=settings['time'])
+        else:
+            result = machine.runFast(None, decider, settings['steps'], settings['time'])
+    except Exception as ex:
+        row['reason'] = 'error'
+        row['error'] = str(ex)
+        return row
+
+    row['reason'] = result.reason
+    row['steps'] = machine.steps
+    row['elapsed'] = round(result.elapsed, 6)
+    row['state'] = machine.currentState
+    row['head'] = machine.tapeHead - machine.tapeOrigin
+    row['nonblank'] = machine.getSigma()
+    row.update(machine.countSymbols())
+    if result.certificate != None:
+        row['certificate'] = json.dumps(result.certificate)
+    return row
+
+# Write the rows passed to the open file as CSV or JSON lines, as each arrives.
+def writeRows(rows, out, outputFormat):
+    if outputFormat == 'csv':
+        writer = csv.DictWriter(out, fieldnames=FIELDS, restval='', lineterminator='\n')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            out.flush()
+    else:
+        for row in rows:
+            out.write(json.dumps(row) + '\n')
+            out.flush()
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Run a batch of TMD-3 .tmd3 saves.')
+    parser.add_argument('paths', nargs='+', help='directories or glob patterns of .tmd3 files')
+    parser.add_argument('--steps', type=int, default=DEFAULT_MAX_STEPS, help='most transitions for each file')
+    parser.add_argument('--time', type=float, default=None, help='most seconds for each file')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes, by default one per core')
+    parser.add_argument('--macro', action='store_true', help='use the macro machine simulation')
+    parser.add_argument('--deciders', action='store_true', help='stop machines proved never to halt')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='output format, by default from the output file name')
+    parser.add_argument('--output', help='file to write the summary to, by default standard output')
+    options = parser.parse_args(args)
+
+    files = findFiles(options.paths)
+    if not files:
+        parser.error('no .tmd3 files found')
+
+    outputFormat = options.format
+    if outputFormat == None:
+        if options.output != None and options.output.endswith(('.jsonl', '.json')):
+            outputFormat = 'jsonl'
+        else:
+            outputFormat = 'csv'
+
+    settings = {'steps': options.steps, 'time': options.time, 'macro': options.macro, 'deciders': options.deciders}
+    jobs = [(filename, settings) for filename in files]
+
+    if options.output != None:
+        out = open(options.output, 'w', newline='')
+    else:
+        out = sys.stdout
+    workers = options.workers or os.cpu_count() or 1
+    try:
+        # Each file is a separate task so long runs do not hold up short ones.
+        with multiprocessing.Pool(max(1, min(workers, len(jobs)))) as pool:
+            writeRows(pool.imap(runFile, jobs, chunksize=1), out, outputFormat)
+    finally:
+        if out != sys.stdout:
+            out.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+# Benchmark suite for the TMD-3 engine, save files and console rendering.
+#
+# Runs the bundled beaver saves and some synthetic large tapes, timing the
+# engine in fast and macro mode, saving and loading, dumpWorkspace() and
+# drawing a console frame with SDL's dummy video driver. Each benchmark is
+# repeated and the best time kept. The results can be saved as a JSON baseline,
+# and a later run compared with it fails if any metric is worse by more than
+# the threshold:
+#
+#   python tmd3Bench.py --save-baseline baseline.json
+#   python tmd3Bench.py --baseline baseline.json --threshold 0.25
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tmd3Engine
+import tmd3Macro
+
+##### Globals
+# Directory holding the bundled beaver saves and the console images.
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Bundled saves that are run to completion.
+BEAVERS = ('beaver3', 'beaver4', 'beaver5')
+
+# Non blank cells on the synthetic tapes.
+LARGE_TAPE_CELLS = 250000
+
+# Each benchmark is repeated this many times and the best kept. Quick ones are
+# looped within each repeat until at least MIN_SECONDS have been timed.
+DEFAULT_REPEATS = 3
+MIN_SECONDS = 0.2
+
+# How much worse than the baseline a metric can be before the suite fails.
+DEFAULT_THRESHOLD = 0.25
+
+##### Functions and classes.
+# Return the best time per call of run() over repeats tries. If prepare is
+# passed it is called (untimed) before each call and its result passed to run.
+def bestTime(run, prepare=None, repeats=DEFAULT_REPEATS):
+    best = None
+    for i in range(repeats):
+        elapsed = 0.0
+        loops = 0
+        while elapsed < MIN_SECONDS or loops == 0:
+            argument = prepare() if prepare != None else None
+            start = time.perf_counter()
+            run(argument)
+            elapsed += time.perf_counter() - start
+            loops += 1
+        if best == None or elapsed / loops < best:
+            best = elapsed / loops
+    return best
+
+# Add a metric to the results passed. better is 'higher' or 'lower'.
+def addMetric(metrics, name, value, unit, better):
+    metrics[name] = {'value': value, 'unit': unit, 'better': better}
+
+# Return a machine loaded from the bundled save passed.
+def loadBeaver(name):
+    machine = tmd3Engine.Machine()
+    machine.loadWorkspace(os.path.join(DIRECTORY, name))
+    return machine
+
+# Return a machine with a synthetic tape of LARGE_TAPE_CELLS cells. 'random'
+# tapes have a random symbol in every cell, 'runs' tapes have runs of up to 50
+# of the same symbol.
+def syntheticMachine(kind):
+    rng = random.Random(1)
+    cells = bytearray()
+    while len(cells) < LARGE_TAPE_CELLS:
+        if kind == 'random':
+            cells.append(rng.randrange(1, 6))
+        else:
+            cells.extend(bytes((rng.randrange(0, 6),)) * rng.randrange(1, 51))
+    del cells[LARGE_TAPE_CELLS:]
+    machine = tmd3Engine.Machine()
+    machine.stateTable = loadBeaver('beaver5').stateTable
+    machine.growTape(1)
+    start = machine.tapeOrigin - LARGE_TAPE_CELLS // 2
+    machine.tape[start:start+LARGE_TAPE_CELLS] = cells
+    machine.touchTape(start, start + LARGE_TAPE_CELLS)
+    machine.recount()
+    return machine
+
+# Time running each bundled beaver to the end in fast and macro mode.
+def benchEngine(metrics, repeats):
+    for name in BEAVERS:
+        for mode in ('fast', 'macro'):
+            steps = []
+            def run(machine):
+                if mode == 'fast':
+                    machine.runFast()
+                else:
+                    tmd3Macro.runMacro(machine)
+                steps.append(machine.steps)
+            elapsed = bestTime(run, lambda: loadBeaver(name), repeats)
+            addMetric(metrics, 'run.{0}.{1}'.format(name, mode), steps[-1] / elapsed, 'steps/s', 'higher')
+
+# Time encoding, decoding, saving, loading and reporting the finished beaver5
+# tape and the synthetic tapes.
+def benchSaves(metrics, repeats):
+    machines = {}
+    machines['beaver5'] = loadBeaver('beaver5')
+    machines['beaver5'].runFast()
+    machines['random'] = syntheticMachine('random')
+    machines['runs'] = syntheticMachine('runs')
+
+    folder = tempfile.mkdtemp()
+    for name, machine in machines.items():
+        filename = os.path.join(folder, name)
+        encoded = machine.encodeTape()
+        machine.saveWorkspace(filename)
+        addMetric(metrics, 'encode.' + name, bestTime(lambda _: machine.encodeTape(), None, repeats), 's', 'lower')
+        addMetric(metrics, 'decode.' + name,
+                  bestTime(lambda _: tmd3Engine.Machine().decodeTape(encoded), None, repeats), 's', 'lower')
+        addMetric(metrics, 'save.' + name, bestTime(lambda _: machine.saveWorkspace(filename), None, repeats), 's', 'lower')
+        addMetric(metrics, 'load.' + name,
+                  bestTime(lambda _: tmd3Engine.Machine().loadWorkspace(filename), None, repeats), 's', 'lower')
+        addMetric(metrics, 'dump.' + name, bestTime(lambda _: machine.dumpWorkspace(), None, repeats), 's', 'lower')
+    for name in os.listdir(folder):
+        os.remove(os.path.join(folder, name))
+    os.rmdir(folder)
+
+# Time drawing a full console frame (tape, state table and display flip) with
+# the finished beaver5 loaded, using SDL's dummy video driver.
+def benchRender(metrics, repeats):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+    # The console loads its images from the current directory.
+    cwd = os.getcwd()
+    os.chdir(DIRECTORY)
+    try:
+        import pygame
+        import Tmd3Console as console
+    finally:
+        os.chdir(cwd)
+
+    machine = loadBeaver('beaver5')
+    machine.runFast()
+    console.machine = machine
+    def frame(_):
+        console.drawTape()
+        console.redrawStateTable()
+        pygame.display.flip()
+    addMetric(metrics, 'render.frame', bestTime(frame, None, repeats), 's', 'lower')
+    addMetric(metrics, 'render.tape', bestTime(lambda _: console.drawTape(), None, repeats), 's', 'lower')
+
+# Return a list of (name, baseline, value, change) for each metric worse than
+# the baseline by more than threshold. change is the fraction it is worse by.
+def findRegressions(metrics, baseline, threshold):
+    regressions = []
+    for name, metric in sorted(metrics.items()):
+        if name not in baseline:
+            continue
+        old = baseline[name]['value']
+        new = metric['value']
+        if old <= 0:
+            continue
+        if metric['better'] == 'higher':
+            change = (old - new) / old
+        else:
+            change = (new - old) / old
+        if change > threshold:
+            regressions.append((name, old, new, change))
+    return regressions
+
+# Print the metrics passed, with the change from the baseline if there is one.
+def printMetrics(metrics, baseline):
+    for name, metric in sorted(metrics.items()):
+        line = '{0:<24} {1:>14.6g} {2:<8}'.format(name, metric['value'], metric['unit'])
+        if name in baseline and baseline[name]['value'] > 0:
+            ratio = metric['value'] / baseline[name]['value']
+            line += ' {0:+.1%} vs baseline'.format(ratio - 1)
+        print(line)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the TMD-3 engine, save files and rendering.')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS, help='times each benchmark is repeated')
+    parser.add_argument('--no-render', dest='render', action='store_false', help='skip the console rendering benchmarks')
+    parser.add_argument('--baseline', help='JSON baseline to compare the results with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fraction a metric can be worse than the baseline before failing')
+    parser.add_argument('--save-baseline', help='file to save the results to as a new baseline')
+    options = parser.parse_args(args)
+
+    baseline = {}
+    if options.baseline != None:
+        f = open(options.baseline, 'r')
+        baseline = json.loads(f.read())['metrics']
+        f.close()
+
+    metrics = {}
+    benchEngine(metrics, options.repeats)
+    benchSaves(metrics, options.repeats)
+    if options.render:
+        benchRender(metrics, options.repeats)
+    printMetrics(metrics, baseline)
+
+    if options.save_baseline != None:
+        results = {'python': platform.python_version(), 'platform': platform.platform(),
+                   'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'metrics': metrics}
+        f = open(options.save_baseline, 'w')
+        f.write(json.dumps(results, indent=2, sort_keys=True))
+        f.close()
+
+    regressions = findRegressions(metrics, baseline, options.threshold)
+    for name, old, new, change in regressions:
+        print('REGRESSION {0}: {1:.6g} -> {2:.6g} ({3:.1%} worse)'.format(name, old, new, change))
+    if regressions:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
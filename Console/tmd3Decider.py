@@ -0,0 +1,219 @@
+# Non-halting deciders for the TMD-3 engine.
+#
+# A CycleDecider is passed to Machine.runFast(), which calls its check() method
+# every DECIDER_LOOPS transitions. It keeps a single snapshot of the machine,
+# replaced at checks 1, 2, 4, 8, ... (Brent's method) so any cycle is found
+# with bounded memory once the snapshots are taken inside it.
+#
+# Let the head be at cell h1 at the snapshot and h2 = h1 + offset now, in the
+# same state and having last moved in the same direction. Between the two the
+# head never went left of some cell low. If offset >= 0 and the tape from low
+# rightwards at the snapshot is the same as the tape from low + offset
+# rightwards now, then the machine only ever reads cells that repeat the
+# snapshot shifted by offset, so it repeats the same transitions every period
+# steps and never halts. The same holds for offset <= 0 and the tape to the left
+# of the highest cell the head reached. The side the head drifts away from
+# proves nothing, since the head never comes back to read it. With an offset
+# of 0 this is a plain cycle, otherwise a translated cycle.
+#
+# Run this module on its own to check that no machine the decider says never
+# halts goes on to halt:
+#
+#   python tmd3Decider.py --machines 200 --steps 100000
+import argparse
+import random
+import sys
+import tmd3Engine
+
+##### Globals
+# How many transitions runFast() makes between calls to check().
+DECIDER_LOOPS = 10000
+
+# Cells next to the head compared before the rest of the tape is.
+FINGERPRINT_CELLS = 256
+
+# Settings for the check.
+DEFAULT_MACHINES = 200
+DEFAULT_STEPS = 100000
+DRIFT_CELLS = 40000
+
+##### Functions and classes.
+# Return the cells of tape from start up to (but not including) end, with blanks
+# for any cells off either end of the tape.
+def readCells(tape, start, end):
+    if start >= 0 and end <= len(tape):
+        return bytes(tape[start:end])
+    cells = bytearray(end - start)
+    first = max(start, 0)
+    last = min(end, len(tape))
+    if first < last:
+        cells[first-start:last-start] = tape[first:last]
+    return bytes(cells)
+
+# True if the cells passed are the same apart from blanks past the end of the
+# shorter. If fromEnd is True the cells are lined up at their ends instead.
+def sameCells(first, second, fromEnd=False):
+    size = min(len(first), len(second))
+    if fromEnd:
+        firstExtra = len(first) - size
+        secondExtra = len(second) - size
+        return (first[firstExtra:] == second[secondExtra:] and first[:firstExtra] == bytes(firstExtra)
+                and second[:secondExtra] == bytes(secondExtra))
+    return (first[:size] == second[:size] and first[size:] == bytes(len(first) - size)
+            and second[size:] == bytes(len(second) - size))
+
+class CycleDecider():
+
+    def __init__(self, cyclers=True, translatedCyclers=True, interval=DECIDER_LOOPS):
+        # Which kinds of cycle to look for and how many transitions apart.
+        self.cyclers = cyclers
+        self.translatedCyclers = translatedCyclers
+        self.interval = interval
+        self.reset()
+
+    # Forget everything seen so far. Called at the start of each run.
+    def reset(self):
+        self.snapshot = None
+        self.checks = 0
+        self.nextSnapshot = 1
+        self.lastCell = None
+        self.lastSteps = 0
+        self.low = 0
+        self.high = 0
+
+    # Called with the running machine's tape, the position of cell 0 and the
+    # head on it, the state, the last head delta and the number of transitions
+    # made. Returns a certificate dictionary if the machine never halts,
+    # otherwise None.
+    def check(self, tape, origin, head, state, delta, steps):
+        cell = head - origin
+
+        # The head moves one cell per transition, so between two checks it stays
+        # within half the transitions made of the middle of the two positions.
+        if self.lastCell != None:
+            span = steps - self.lastSteps
+            self.low = min(self.low, (self.lastCell + cell - span) // 2)
+            self.high = max(self.high, -((-self.lastCell - cell - span) // 2))
+        self.lastCell = cell
+        self.lastSteps = steps
+
+        certificate = None
+        if self.snapshot != None:
+            certificate = self.compare(tape, origin, cell, state, delta, steps)
+
+        # Move the snapshot up at checks 1, 2, 4, 8, ...
+        self.checks += 1
+        if certificate == None and self.checks == self.nextSnapshot:
+            self.nextSnapshot *= 2
+            self.snapshot = (bytes(tape), origin, cell, state, delta, steps)
+            self.low = cell
+            self.high = cell
+        return certificate
+
+    # Compare the machine with the snapshot. Returns a certificate if one side
+    # of the tape repeats it, otherwise None.
+    def compare(self, tape, origin, cell, state, delta, steps):
+        snapTape, snapOrigin, snapCell, snapState, snapDelta, snapSteps = self.snapshot
+        if state != snapState or delta != snapDelta:
+            return None
+        offset = cell - snapCell
+        if offset == 0 and not self.cyclers:
+            return None
+        if offset != 0 and not self.translatedCyclers:
+            return None
+
+        # The cells next to the head are the fingerprint, checked first.
+        snapHead = snapOrigin + snapCell
+        head = origin + cell
+        size = FINGERPRINT_CELLS
+        repeats = False
+        if offset >= 0 and readCells(snapTape, snapHead, snapHead+size) == readCells(tape, head, head+size):
+            # Everything from the lowest cell visited rightwards.
+            start = snapOrigin + self.low
+            snapCells = readCells(snapTape, start, max(start, len(snapTape)))
+            start = origin + self.low + offset
+            cells = readCells(tape, start, max(start, len(tape)))
+            repeats = sameCells(snapCells, cells)
+        if (not repeats and offset <= 0
+                and readCells(snapTape, snapHead-size+1, snapHead+1) == readCells(tape, head-size+1, head+1)):
+            # Everything from the highest cell visited leftwards.
+            end = snapOrigin + self.high + 1
+            snapCells = readCells(snapTape, min(0, end), end)
+            end = origin + self.high + offset + 1
+            cells = readCells(tape, min(0, end), end)
+            repeats = sameCells(snapCells, cells, True)
+        if not repeats:
+            return None
+
+        certificate = {}
+        if offset == 0:
+            certificate['decider'] = 'cycler'
+        else:
+            certificate['decider'] = 'translated cycler'
+        certificate['period'] = steps - snapSteps
+        certificate['offset'] = offset
+        certificate['step'] = steps
+        return certificate
+
+# Return a machine that moves the way passed ('L' or 'R') across DRIFT_CELLS
+# 1s, blanking them, and halts on the 2 past them. Behind the head the tape is
+# blank and repeats itself shifted, but the machine halts all the same.
+def driftMachine(move):
+    machine = tmd3Engine.Machine()
+    machine.clearStateTable()
+    machine.stateTable['A0'] = ['0', '0', move, 'A']
+    machine.stateTable['A1'] = ['1', '0', move, 'A']
+    machine.stateTable['A2'] = ['2', '2', move, 'H']
+    delta = tmd3Engine.MOVE_DELTAS[move]
+    machine.growTape(delta * (DRIFT_CELLS + 2))
+    for cell in range(1, DRIFT_CELLS + 1):
+        machine.tape[machine.tapeHead+delta*cell] = 1
+    machine.tape[machine.tapeHead+delta*(DRIFT_CELLS+1)] = 2
+    machine.findTouched()
+    machine.recount()
+    return machine
+
+# Return a machine with a random state transition table for states A - C and
+# symbols 0 - 2 on a blank tape.
+def randomMachine(rng):
+    machine = tmd3Engine.Machine()
+    machine.clearStateTable()
+    for state in 'ABC':
+        for symbol in '012':
+            goto = rng.choice('ABC')
+            if rng.random() < 0.05:
+                goto = 'H'
+            machine.stateTable[state+symbol] = [symbol, rng.choice('012'), rng.choice('LR'), goto]
+    return machine
+
+# Run the drift machines and random tables with a CycleDecider, and check that
+# any the decider says never halt still have not halted after running on for
+# as many steps again without it.
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Check the TMD-3 non-halting deciders.')
+    parser.add_argument('--machines', type=int, default=DEFAULT_MACHINES, help='number of random tables')
+    parser.add_argument('--steps', type=int, default=DEFAULT_STEPS, help='most transitions for each table')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the random tables')
+    options = parser.parse_args(args)
+
+    rng = random.Random(options.seed)
+    machines = [driftMachine('L'), driftMachine('R')]
+    machines += [randomMachine(rng) for i in range(options.machines)]
+    decided = 0
+    wrong = 0
+    for machine in machines:
+        plain = machine.copy()
+        result = machine.runFast(decider=CycleDecider(), maxSteps=options.steps)
+        if result.reason != 'non-halting':
+            continue
+        decided += 1
+        if plain.runFast(maxSteps=2*result.steps+options.steps).reason != 'budget':
+            wrong += 1
+            print('Wrongly decided: {0} {1}'.format(plain.stateTable, result.certificate))
+    print('{0} machines, {1} decided never halting, {2} wrongly.'.format(len(machines), decided, wrong))
+    if wrong:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+# Space-time diagrams of TMD-3 runs.
+#
+# A space-time diagram is an image of the tape over time: each row is the tape
+# at one time, oldest at the top, and each column a range of cells. The image
+# is kept at a fixed size however long the run, so memory does not grow with it.
+# The run is sampled every stride steps and each sample added into a row. When
+# every row has been used, pairs of rows are merged into one and the stride
+# doubles. When a sample reaches past the cells the columns cover, pairs of
+# columns are merged into one, doubling the cells per column. Each pixel is the
+# average color of the cells and samples it covers, with the tape head in red.
+#
+# This module needs NumPy, which the rest of the TMD-3 does not. The image can be
+# written as a PNG, or shown in a pygame window that scrolls with the arrow keys
+# and the mouse wheel:
+#
+#   python tmd3Diagram.py beaver5 beaver5.png --show
+import argparse
+import struct
+import zlib
+import numpy
+import tmd3Engine
+
+##### Globals
+# Most columns and rows in a diagram.
+DIAGRAM_WIDTH = 1000
+DIAGRAM_HEIGHT = 1000
+
+# Colors of the tape values 0 - 4 and 'b', and of the tape head.
+DIAGRAM_COLORS = ((255, 255, 255), (128, 0, 128), (0, 160, 0), (0, 90, 255), (255, 160, 0), (100, 100, 100))
+HEAD_COLOR = (255, 0, 0)
+
+# Most steps run when no limit is given, in case the machine never halts.
+DIAGRAM_MAX_STEPS = 100000000
+
+# Most cells read from the tape at a time when sampling, so the memory a
+# sample uses does not grow with the tape.
+SAMPLE_CHUNK_CELLS = 1 << 16
+
+# Pixels scrolled for each arrow key press or mouse wheel click in the viewer.
+SCROLL_PIXELS = 40
+
+# Largest viewer window.
+VIEW_WIDTH = 1000
+VIEW_HEIGHT = 700
+
+##### Functions and classes.
+# A space-time diagram of at most width columns and height rows (height must be
+# even). Pixels are kept as ink, the difference from the blank color summed
+# over the cells and samples they cover, so cells never reached add nothing.
+class SpaceTimeDiagram():
+
+    def __init__(self, width=DIAGRAM_WIDTH, height=DIAGRAM_HEIGHT):
+        self.width = width
+        self.height = height
+        self.ink = numpy.zeros((height, width, 3), numpy.float64)
+        self.counts = numpy.zeros(height, numpy.int64)
+        self.palette = numpy.array(DIAGRAM_COLORS[0], numpy.float64) - numpy.array(DIAGRAM_COLORS, numpy.float64)
+        self.headInk = numpy.array(DIAGRAM_COLORS[0], numpy.float64) - numpy.array(HEAD_COLOR, numpy.float64)
+
+        # Steps between samples, and the first cell and cells per column.
+        self.stride = 1
+        self.left = None
+        self.cellsPerColumn = 1
+
+        # Row the next sample goes into.
+        self.row = 0
+
+        # Cells the tape has held symbols in or the head has been at, and the
+        # step count at the last sample.
+        self.start = None
+        self.end = None
+        self.steps = None
+
+    # Add the tape of the machine passed, as it is now, as the next sample.
+    def addSample(self, machine):
+        tape = machine.tape
+        origin = machine.tapeOrigin
+        head = machine.tapeHead - origin
+        if self.start == None:
+            start, end = machine.getExtent()
+            start -= origin
+            end -= origin
+        else:
+            # The head moves a cell per step, so only the cells it could have
+            # reached since the last sample need searching.
+            reach = abs(machine.steps - self.steps)
+            start = self.start
+            first = max(-origin, start - reach)
+            cells = tape[first+origin:start+origin]
+            if cells.strip(b'\0'):
+                start = first + len(cells) - len(cells.lstrip(b'\0'))
+            end = self.end
+            last = min(len(tape) - origin, end + reach)
+            cells = tape[end+origin:last+origin]
+            if cells.strip(b'\0'):
+                end += len(cells.rstrip(b'\0'))
+        self.start = min(start, head)
+        self.end = max(end, head + 1)
+        self.steps = machine.steps
+        start = self.start
+        end = self.end
+        self.fitCells(start, end)
+
+        # Merge rows once they are all full.
+        if self.row == self.height:
+            self.mergeRows()
+
+        # Count each tape value in each column, a chunk of the tape at a time,
+        # and add up their ink.
+        cellsPerColumn = self.cellsPerColumn
+        values = len(DIAGRAM_COLORS)
+        counts = numpy.zeros(self.width * values, numpy.int64)
+        first = max(self.left, start)
+        last = min(self.left + self.width * cellsPerColumn, end)
+        while first < last:
+            stop = min(last, first + SAMPLE_CHUNK_CELLS)
+            cells = numpy.frombuffer(tape, numpy.uint8, stop - first, first + origin)
+            column = (first - self.left) // cellsPerColumn
+            bins = (numpy.arange(first - self.left, stop - self.left) // cellsPerColumn - column) * values + cells
+            chunk = numpy.bincount(bins)
+            counts[column*values:column*values+len(chunk)] += chunk
+            first = stop
+        ink = counts.reshape(self.width, values) @ self.palette
+        ink[(head-self.left)//cellsPerColumn] += self.headInk - self.palette[tape[head+origin]]
+        self.ink[self.row] = ink
+        self.counts[self.row] = 1
+        self.row += 1
+
+    # Widen the columns until they cover cells start up to end.
+    def fitCells(self, start, end):
+        if self.left == None:
+            self.left = start - max(0, (self.width - (end - start)) // 2)
+        while start < self.left or end > self.left + self.width * self.cellsPerColumn:
+            # The old columns end up as half as many (rounded up), offset
+            # columns from the new left hand end. The half left over goes to
+            # the side that is growing, as much of it to the left as the right
+            # can spare when both are.
+            half = self.width // 2
+            wider = self.cellsPerColumn * 2
+            offset = 0
+            if start < self.left:
+                needLeft = -((start - self.left) // wider)
+                needRight = max(0, -((self.left + (self.width - half) * wider - end) // wider))
+                offset = min(half, max(needLeft, half - needRight))
+            merged = self.ink[:, 0:2*half:2] + self.ink[:, 1:2*half:2]
+            last = self.ink[:, 2*half:].sum(axis=1)
+            self.ink[:] = 0
+            self.ink[:, offset:offset+half] = merged
+            if self.width % 2:
+                self.ink[:, offset+half] = last
+            self.left -= offset * wider
+            self.cellsPerColumn = wider
+
+    # Merge each pair of rows into one and double the stride.
+    def mergeRows(self):
+        half = self.height // 2
+        self.ink[:half] = self.ink[0::2] + self.ink[1::2]
+        self.ink[half:] = 0
+        self.counts[:half] = self.counts[0::2] + self.counts[1::2]
+        self.counts[half:] = 0
+        self.row = half
+        self.stride *= 2
+
+    # Return the diagram as a (rows, columns, 3) array of 8 bit RGB pixels.
+    def pixels(self):
+        rows = self.row
+        counts = numpy.maximum(self.counts[:rows], 1)[:, None, None] * self.cellsPerColumn
+        blank = numpy.array(DIAGRAM_COLORS[0], numpy.float64)
+        return numpy.clip(numpy.rint(blank - self.ink[:rows] / counts), 0, 255).astype(numpy.uint8)
+
+# Run the machine passed for at most maxSteps transitions, or until it stops,
+# and return its SpaceTimeDiagram. The machine is left where the run stopped.
+def drawDiagram(machine, maxSteps=DIAGRAM_MAX_STEPS, width=DIAGRAM_WIDTH, height=DIAGRAM_HEIGHT):
+    diagram = SpaceTimeDiagram(width, height)
+    diagram.addSample(machine)
+    steps = 0
+    while steps < maxSteps:
+        # Sample at multiples of the stride, so samples from before and after
+        # a merge line up.
+        stride = diagram.stride - steps % diagram.stride
+        result = machine.runFast(maxSteps=min(stride, maxSteps - steps))
+        steps += result.steps
+        diagram.addSample(machine)
+        if result.reason != 'budget':
+            break
+    return diagram
+
+# Write the (rows, columns, 3) array of pixels passed to a PNG file, a row at a
+# time.
+def writePng(filename, pixels):
+    rows, columns = pixels.shape[:2]
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    f = open(filename, 'wb')
+    f.write(b'\x89PNG\r\n\x1a\n')
+    f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', columns, rows, 8, 2, 0, 0, 0)))
+    compressor = zlib.compressobj(6)
+    data = b''
+    for row in range(rows):
+        # Each row starts with filter type 0 (none).
+        data += compressor.compress(b'\0' + pixels[row].tobytes())
+        if len(data) >= 65536:
+            f.write(chunk(b'IDAT', data))
+            data = b''
+    data += compressor.flush()
+    f.write(chunk(b'IDAT', data))
+    f.write(chunk(b'IEND', b''))
+    f.close()
+
+# Show the pixels passed in a pygame window until it is closed or ESC pressed.
+# The arrow keys and the mouse wheel scroll images bigger than the window.
+def showDiagram(pixels, title='TMD-3 space-time diagram'):
+    import pygame
+    rows, columns = pixels.shape[:2]
+    pygame.init()
+    screen = pygame.display.set_mode((min(columns, VIEW_WIDTH), min(rows, VIEW_HEIGHT)))
+    pygame.display.set_caption(title)
+    image = pygame.surfarray.make_surface(pixels.swapaxes(0, 1))
+    x = 0
+    y = 0
+    clock = pygame.time.Clock()
+    done = False
+    while not done:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                done = True
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    done = True
+                elif event.key == pygame.K_UP:
+                    y -= SCROLL_PIXELS
+                elif event.key == pygame.K_DOWN:
+                    y += SCROLL_PIXELS
+                elif event.key == pygame.K_LEFT:
+                    x -= SCROLL_PIXELS
+                elif event.key == pygame.K_RIGHT:
+                    x += SCROLL_PIXELS
+                elif event.key == pygame.K_PAGEUP:
+                    y -= screen.get_height()
+                elif event.key == pygame.K_PAGEDOWN:
+                    y += screen.get_height()
+            elif event.type == pygame.MOUSEWHEEL:
+                y -= event.y * SCROLL_PIXELS
+                x += event.x * SCROLL_PIXELS
+        x = max(0, min(x, columns - screen.get_width()))
+        y = max(0, min(y, rows - screen.get_height()))
+        screen.fill(DIAGRAM_COLORS[0])
+        screen.blit(image, (-x, -y))
+        pygame.display.flip()
+        clock.tick(30)
+    pygame.quit()
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Draw a space-time diagram of a TMD-3 run.')
+    parser.add_argument('workspace', help='saved workspace to run')
+    parser.add_argument('image', nargs='?', help='PNG file to write')
+    parser.add_argument('--steps', type=int, default=DIAGRAM_MAX_STEPS, help='most transitions to run')
+    parser.add_argument('--width', type=int, default=DIAGRAM_WIDTH, help='most columns in the image')
+    parser.add_argument('--height', type=int, default=DIAGRAM_HEIGHT, help='most rows in the image (even)')
+    parser.add_argument('--show', action='store_true', help='show the image in a window')
+    options = parser.parse_args(args)
+    if options.height % 2:
+        parser.error('--height must be even.')
+
+    machine = tmd3Engine.Machine()
+    machine.loadWorkspace(options.workspace)
+    start = machine.steps
+    diagram = drawDiagram(machine, options.steps, options.width, options.height)
+    pixels = diagram.pixels()
+    print('{0:,} steps, {1} rows of {2:,} steps, {3} columns of {4:,} cells from cell {5}.'.format(machine.steps - start,
+          pixels.shape[0], diagram.stride, pixels.shape[1], diagram.cellsPerColumn, diagram.left))
+    if options.image != None:
+        writePng(options.image, pixels)
+    if options.show:
+        showDiagram(pixels, options.workspace)
+
+if __name__ == '__main__':
+    main()
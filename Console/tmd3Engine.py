@@ -0,0 +1,1059 @@
+# Headless Turing machine engine for the TMD-3.
+#
+# The Machine class holds the state transition table, the tape, the tape head
+# and the running state. Importing this module has no pygame or hardware side
+# effects so machines can be run from scripts, worker processes and tests. The
+# console (Tmd3Console.py) is a view that sits on top of a Machine.
+import ast
+import collections
+import io
+import re
+import struct
+import time
+import zlib
+
+##### Globals
+# Number of cells on the tape at start up. The cell under the head at start up
+# is cell 0. The tape grows at either end whenever the head gets near it.
+TAPE_NUMBER_CELLS = 100000
+
+# The console shows this many cells centered on the tape head, so the tape is
+# grown before the head gets closer than half of them to either end.
+TAPE_CELLS = 11
+TAPE_MARGIN = int(TAPE_CELLS/2) + 1
+
+# Fewest cells added when the tape grows. The tape at least doubles each time so
+# the cost of growing it is amortized over the cells added.
+TAPE_GROW_CELLS = 100000
+
+# State names and the read symbol columns of the state transition table.
+STATES = ('A', 'B', 'C', 'D', 'E', 'F')
+SYMBOLS = ('0', '1', '2', '3', '4')
+
+# The engines call their poll function about every POLL_INTERVAL seconds. They
+# run in chunks of transitions between polls, starting with FIRST_POLL_LOOPS
+# and resized after each poll to take POLL_INTERVAL at the speed just measured.
+POLL_INTERVAL = 0.05
+FIRST_POLL_LOOPS = 10000
+MIN_POLL_LOOPS = 100
+MAX_POLL_LOOPS = 100000000
+
+# Row length of the compiled state transition table, one entry per tape value.
+TABLE_STRIDE = 6
+
+# Codes used in the compiled state transition table.
+UNDEFINED = -1
+HALT = -2
+BOUNDARY = -3
+SELF_LOOP = -4
+
+# Size of the first window scanned when skipping over a run of symbols. The
+# window doubles each time the run reaches its end.
+RUN_SCAN_WINDOW = 64
+
+# Head deltas for the move symbols. Moving the tape left moves the head to the
+# next higher cell.
+MOVE_DELTAS = {'L': 1, 'R': -1, ' ': 0}
+MOVE_DIRECTIONS = {1: 'L', -1: 'R', 0: ' '}
+
+# Steps per second are measured over the samples from the last METRICS_WINDOW
+# seconds, keeping at most METRICS_SAMPLES of them.
+METRICS_WINDOW = 2.0
+METRICS_SAMPLES = 256
+
+# A .tmd3 save starts with SAVE_MAGIC and the save version. Older saves are the
+# text of the dictionary made by getSave(), and are still read.
+SAVE_MAGIC = b'TMD3SAV\0'
+SAVE_VERSION = 1
+SAVE_HEADER = struct.Struct('<8sI')
+
+# Then the tape length, the positions of the tape head and cell 0, the position
+# and number of the cells from the first to the last non blank one, the state,
+# step, last move direction, transition ('' for none) and the number of state
+# transition table entries. Each entry is its 2 character key and 4 symbols.
+# The cells follow, compressed with zlib.
+SAVE_FIELDS = struct.Struct('<QQQQQ1s5s1s4sI')
+SAVE_ENTRY = struct.Struct('<2s4s')
+
+# The run length encoding of the tape in text saves is the digit of each cell,
+# with runs of more than 5 cells of the same value written as '[count]digit'.
+TAPE_DIGITS = bytes.maketrans(bytes(range(TABLE_STRIDE)), b'012345')
+TAPE_VALUES = bytes.maketrans(b'012345', bytes(range(TABLE_STRIDE)))
+LONG_RUN = re.compile(rb'0{6,}|1{6,}|2{6,}|3{6,}|4{6,}|5{6,}')
+RUN_TOKEN = re.compile(r'\[(\d+)\]([0-5])')
+
+# The text report writes the tape REPORT_CHUNK_CELLS cells at a time, showing
+# 5 as 'b'. Saved reports of tapes with more than REPORT_LONG_TAPE cells from
+# the first to the last non blank one show REPORT_LINE_CELLS cells to a line,
+# with runs of REPORT_RUN_CELLS or more of a symbol shown as one cell.
+REPORT_CHUNK_CELLS = 65536
+REPORT_SYMBOLS = bytes.maketrans(bytes(range(TABLE_STRIDE)), b'01234b')
+REPORT_LONG_TAPE = 10000
+REPORT_LINE_CELLS = 50
+REPORT_RUN_CELLS = 10
+
+##### Functions and classes.
+class Machine():
+
+    def __init__(self):
+        # Dictionary to hold the finite state table.
+        self.stateTable = {}
+
+        # Tape values will be stored here.
+        self.tape = bytearray(TAPE_NUMBER_CELLS)
+        self.tapeHead = int(TAPE_NUMBER_CELLS / 2) # The read/write position on the tape
+        self.tapeOrigin = int(TAPE_NUMBER_CELLS / 2) # The position of cell 0 on the tape
+
+        # Cells touchedStart up to touchedEnd (from cell 0) take in every cell
+        # ever written and the cells the head has stopped on since the tape was
+        # cleared, so every non blank cell. They are kept as cells rather than
+        # tape positions as the tape grows at the left. See getExtent().
+        self.touchedStart = 0
+        self.touchedEnd = 1
+
+        # Number of cells on the tape holding each tape value, indexed by value.
+        # Blanks (0) are not counted. Kept up to date as the tape is written.
+        self.symbolCounts = [0] * TABLE_STRIDE
+
+        # Start of state machine running code.
+        self.currentState = 'A'
+        self.currentStep = 'READ'
+
+        # The current transition being processed.
+        self.currentTransition = None
+
+        # Keep track of the tape movement direction for the last transition.
+        self.lastMoveDirection = ' '
+
+        # Number of transitions made since the machine was started.
+        self.steps = 0
+
+        # Throughput counters, see getMetrics().
+        self.metrics = RunMetrics()
+
+        # Times each compiled state transition table entry has fired while
+        # profiling, or None when not profiling. See startProfile().
+        self.hits = None
+        self.hitIndex = None
+
+        self.clearStateTable()
+
+    # Set the state transition table data structure to default values.
+    def clearStateTable(self):
+        for state in STATES:
+            for value in SYMBOLS:
+                if value == '4':
+                    self.stateTable[state+value] = [' ', ' ', ' ', ' ']
+                else:
+                    self.stateTable[state+value] = [value, ' ', ' ', ' ']
+        self.currentTransition = None
+
+    # Set the tape back to its start up size, all blanks (0), and center the tape head.
+    def clearTape(self):
+        # 0 will be the blank character. Only the touched cells need clearing.
+        if len(self.tape) == TAPE_NUMBER_CELLS:
+            start = max(0, self.tapeOrigin + self.touchedStart)
+            end = min(len(self.tape), self.tapeOrigin + self.touchedEnd)
+            self.tape[start:end] = bytes(max(0, end - start))
+        else:
+            self.tape[:] = bytes(TAPE_NUMBER_CELLS)
+        self.tapeHead = int(TAPE_NUMBER_CELLS / 2)
+        self.tapeOrigin = int(TAPE_NUMBER_CELLS / 2)
+        self.touchedStart = 0
+        self.touchedEnd = 1
+        self.symbolCounts = [0] * TABLE_STRIDE
+
+    # Write the value passed to the cell at tape position, keeping the touched
+    # cells and the symbol counts up to date.
+    def writeCell(self, position, value):
+        counts = self.symbolCounts
+        old = self.tape[position]
+        if old:
+            counts[old] -= 1
+        if value:
+            counts[value] += 1
+        self.tape[position] = value
+        self.touchTape(position, position + 1)
+
+    # Return the number of cells holding each tape value from tape position start
+    # up to end, indexed by value. Blanks are not counted.
+    def countCells(self, start, end):
+        tape = self.tape
+        return [0] + [tape.count(value, start, end) for value in range(1, TABLE_STRIDE)]
+
+    # Change the symbol counts by the difference between before, from
+    # countCells(), and the counts from tape position start up to end now. Any
+    # cells written since before was counted must be in both, or have been
+    # blank.
+    def recountCells(self, before, start, end):
+        after = self.countCells(start, end)
+        for value in range(1, TABLE_STRIDE):
+            self.symbolCounts[value] += after[value] - before[value]
+
+    # Return the tape positions of the first touched cell within reach cells of
+    # cell and of the one after the last. A reach of None takes in all of the
+    # touched cells.
+    def reachCells(self, cell, reach):
+        start = self.touchedStart + self.tapeOrigin
+        end = self.touchedEnd + self.tapeOrigin
+        if reach != None:
+            start = max(start, cell - reach + self.tapeOrigin)
+            end = min(end, cell + reach + 1 + self.tapeOrigin)
+        return start, max(start, end)
+
+    # Count the symbols in the touched cells again from scratch.
+    def recount(self):
+        self.symbolCounts = self.countCells(*self.reachCells(0, None))
+
+    # Return the number of non blank cells on the tape, the busy beaver score.
+    def getSigma(self):
+        return sum(self.symbolCounts)
+
+    # Take tape positions start up to end into the touched cells. Call after
+    # writing to the tape other than through the machine.
+    def touchTape(self, start, end):
+        self.touchedStart = min(self.touchedStart, start - self.tapeOrigin)
+        self.touchedEnd = max(self.touchedEnd, end - self.tapeOrigin)
+
+    # Take into the touched cells any non blank cells within reach cells of
+    # cell, which is as far as reach transitions from cell could have written,
+    # and the cell under the head. Only the cells outside the touched ones are
+    # searched.
+    def touchReach(self, cell, reach):
+        tape = self.tape
+        origin = self.tapeOrigin
+        first = max(-origin, cell - reach)
+        if first < self.touchedStart:
+            cells = tape[first+origin:self.touchedStart+origin]
+            blanks = len(cells) - len(cells.lstrip(b'\0'))
+            if blanks < len(cells):
+                self.touchedStart = first + blanks
+        last = min(len(tape) - origin, cell + reach + 1)
+        if last > self.touchedEnd:
+            cells = tape[self.touchedEnd+origin:last+origin]
+            self.touchedEnd += len(cells.rstrip(b'\0'))
+        self.touchTape(self.tapeHead, self.tapeHead + 1)
+
+    # Take every non blank cell on the tape and the cell under the head as the
+    # touched cells, searching the whole tape, and count the symbols again.
+    # Call after writing to the tape other than through the machine.
+    def findTouched(self):
+        tape = self.tape
+        start = len(tape) - len(tape.lstrip(b'\0'))
+        end = len(tape.rstrip(b'\0'))
+        if end == 0:
+            start = end = self.tapeHead
+        self.touchedStart = min(start, self.tapeHead) - self.tapeOrigin
+        self.touchedEnd = max(end, self.tapeHead + 1) - self.tapeOrigin
+        self.recount()
+
+    # Return the tape positions of the first non blank cell and the one after
+    # the last, searching only the touched cells. Both are the tape head
+    # position if the tape is blank.
+    def getExtent(self):
+        tape = self.tape
+        start = max(0, self.tapeOrigin + self.touchedStart)
+        end = min(len(tape), self.tapeOrigin + self.touchedEnd)
+        cells = tape[start:end]
+        used = cells.strip(b'\0')
+        if not used:
+            return self.tapeHead, self.tapeHead
+        start += len(cells) - len(cells.lstrip(b'\0'))
+        return start, start + len(used)
+
+    # Add blank cells to the end of the tape in the direction of delta. Cells
+    # are appended in place at the right end. At the left end the positions of
+    # the tape head and cell 0 move up by the number of cells added, which is
+    # returned.
+    def growTape(self, delta):
+        tape = self.tape
+        count = max(TAPE_GROW_CELLS, len(tape))
+        if delta > 0:
+            tape.extend(bytes(count))
+            return 0
+        tape[0:0] = bytes(count)
+        self.tapeHead += count
+        self.tapeOrigin += count
+        return count
+
+    # Move the tape head by delta cells, growing the tape if the head gets too
+    # close to either end.
+    def shiftHead(self, delta):
+        self.tapeHead += delta
+        while self.tapeHead < TAPE_MARGIN:
+            self.growTape(-1)
+        while self.tapeHead > len(self.tape) - 1 - TAPE_MARGIN:
+            self.growTape(1)
+
+    # Return a new machine with its own copies of the state transition table,
+    # the tape and the running state of this one.
+    def copy(self):
+        machine = Machine()
+        machine.stateTable = {key: list(transition) for key, transition in self.stateTable.items()}
+        machine.tape = bytearray(self.tape)
+        machine.tapeHead = self.tapeHead
+        machine.tapeOrigin = self.tapeOrigin
+        machine.touchedStart = self.touchedStart
+        machine.touchedEnd = self.touchedEnd
+        machine.symbolCounts = list(self.symbolCounts)
+        machine.currentState = self.currentState
+        machine.currentStep = self.currentStep
+        if self.currentTransition != None:
+            machine.currentTransition = list(self.currentTransition)
+        machine.lastMoveDirection = self.lastMoveDirection
+        machine.steps = self.steps
+        if self.hits != None:
+            machine.hits = list(self.hits)
+        return machine
+
+    # Start counting how often each transition fires, from zero. Runs made
+    # while profiling take a slower path through runFast().
+    def startProfile(self):
+        self.hits = [0] * (len(STATES) * TABLE_STRIDE)
+
+    # Stop counting transitions.
+    def stopProfile(self):
+        self.hits = None
+
+    # Return how often each transition has fired since profiling started, as a
+    # dictionary keyed like the state transition table. 'b' is counted in
+    # column '4', where it is read. None when not profiling.
+    def getHits(self):
+        if self.hits == None:
+            return None
+        hits = {}
+        for state in range(len(STATES)):
+            for symbol in range(TABLE_STRIDE):
+                key = STATES[state] + SYMBOLS[min(symbol, 4)]
+                hits[key] = hits.get(key, 0) + self.hits[state * TABLE_STRIDE + symbol]
+        return hits
+
+    # Return the steps made in each state since profiling started, as a
+    # dictionary keyed by state. None when not profiling.
+    def getStateSteps(self):
+        hits = self.getHits()
+        if hits == None:
+            return None
+        return {state: sum(hits[state+symbol] for symbol in SYMBOLS) for state in STATES}
+
+    # Set the running state.
+    def resetState(self, state, step):
+        self.currentState = state
+        self.currentStep = step
+
+    # Run length encode the tape for saving. The cells are turned into digits in
+    # one pass and only the long runs are replaced one at a time. Only the non
+    # blank cells are encoded, with the blanks either side of them a run each.
+    def encodeTape(self):
+        tape = self.tape
+        start, end = self.getExtent()
+        if start == end:
+            start = end = len(tape)
+        def blanks(count):
+            if count > 5:
+                return '[' + str(count) + ']0'
+            return '0' * count
+        digits = tape[start:end].translate(TAPE_DIGITS)
+        encoded = LONG_RUN.sub(lambda run: b'[%d]%c' % (len(run.group(0)), run.group(0)[0]), digits)
+        return blanks(start) + encoded.decode() + blanks(len(tape) - end)
+
+    # Decode the run length encoding passed into the tape. The tape is resized
+    # to the decoded length, but never below its start up size.
+    def decodeTape(self, compressed):
+        # Splitting on the runs leaves the digits between them, then the count
+        # and digit of each run, in turn.
+        parts = RUN_TOKEN.split(compressed)
+        cells = [parts[0].encode().translate(TAPE_VALUES)]
+        for i in range(1, len(parts), 3):
+            cells.append(bytes((int(parts[i+1]),)) * int(parts[i]))
+            cells.append(parts[i+2].encode().translate(TAPE_VALUES))
+        tape = b''.join(cells)
+        if len(tape) < TAPE_NUMBER_CELLS:
+            tape += bytes(TAPE_NUMBER_CELLS - len(tape))
+        self.tape[:] = tape
+
+    # Return the raw tape, state transition table and running state as a dictionary.
+    def getSave(self):
+        save = {}
+        save['tape'] = self.encodeTape()
+        save['table'] = self.stateTable
+        save['tapehead'] = self.tapeHead
+        save['origin'] = self.tapeOrigin
+        save['state'] = self.currentState
+        save['step'] = self.currentStep
+        save['transition'] = self.currentTransition
+        return save
+
+    # Restore the machine from a dictionary created by getSave(). Saves made
+    # before the tape could grow have no origin and always had cell 0 in the
+    # middle of the tape.
+    def setSave(self, save):
+        self.decodeTape(save['tape'])
+        self.stateTable = save['table']
+        self.tapeHead = save['tapehead']
+        self.tapeOrigin = save.get('origin', int(TAPE_NUMBER_CELLS / 2))
+        self.shiftHead(0)
+        self.findTouched()
+        self.currentState = save['state']
+        self.currentStep = save['step']
+        self.currentTransition = save['transition']
+
+    # Return the machine packed in the binary .tmd3 format. Only the cells from
+    # the first to the last non blank one are stored.
+    def packSave(self):
+        tape = self.tape
+        start, end = self.getExtent()
+        transition = ''.join(self.currentTransition or ())
+        data = [SAVE_HEADER.pack(SAVE_MAGIC, SAVE_VERSION),
+                SAVE_FIELDS.pack(len(tape), self.tapeHead, self.tapeOrigin, start, end - start,
+                                 self.currentState.encode(), self.currentStep.encode(),
+                                 self.lastMoveDirection.encode(), transition.encode(), len(self.stateTable))]
+        for key, entry in self.stateTable.items():
+            data.append(SAVE_ENTRY.pack(key.encode(), ''.join(entry).encode()))
+        data.append(zlib.compress(tape[start:end], 1))
+        return b''.join(data)
+
+    # Restore the machine from the binary .tmd3 format made by packSave().
+    def unpackSave(self, data):
+        magic, version = SAVE_HEADER.unpack_from(data)
+        if magic != SAVE_MAGIC:
+            raise ValueError('Not a TMD-3 save.')
+        if version > SAVE_VERSION:
+            raise ValueError('The save is a newer version ({0}).'.format(version))
+        fields = SAVE_FIELDS.unpack_from(data, SAVE_HEADER.size)
+        size, head, origin, start, count, state, step, direction, transition, entries = fields
+        offset = SAVE_HEADER.size + SAVE_FIELDS.size
+        stateTable = {}
+        for i in range(entries):
+            key, entry = SAVE_ENTRY.unpack_from(data, offset)
+            stateTable[key.decode()] = list(entry.decode())
+            offset += SAVE_ENTRY.size
+        cells = zlib.decompress(data[offset:])
+        if len(cells) != count or start + count > size or head >= size or origin >= size:
+            raise ValueError('The save is damaged.')
+        tape = bytearray(size)
+        tape[start:start+count] = cells
+        self.tape[:] = tape
+        self.stateTable = stateTable
+        self.tapeHead = head
+        self.tapeOrigin = origin
+        self.shiftHead(0)
+        self.touchedStart = 0
+        self.touchedEnd = 1
+        self.touchTape(start, start + count)
+        self.touchTape(self.tapeHead, self.tapeHead + 1)
+        self.recount()
+        self.currentState = state.decode()
+        self.currentStep = step.rstrip(b'\0').decode()
+        self.lastMoveDirection = direction.decode()
+        transition = transition.rstrip(b'\0').decode()
+        self.currentTransition = list(transition) if transition else None
+
+    # Load the machine from the .tmd3 file passed (without the extension).
+    # Older text saves are read as a literal, so no code in them is run. Saves
+    # do not hold a step count, so the loaded machine starts again from step 0
+    # with its throughput counters cleared.
+    def loadWorkspace(self, filename):
+        f = open(filename+'.tmd3',"rb")
+        data = f.read()
+        f.close()
+        if data.startswith(SAVE_MAGIC):
+            self.unpackSave(data)
+        else:
+            self.setSave(ast.literal_eval(data.decode()))
+        self.steps = 0
+        self.metrics = RunMetrics()
+
+    # Save the machine to the .tmd3 file passed (without the extension) along
+    # with a readable .txt version.
+    def saveWorkspace(self, filename):
+        f = open(filename+'.tmd3',"wb")
+        f.write(self.packSave())
+        f.close()
+
+        # Save a readable version of the tape and state transition table. Long
+        # tapes are wrapped and their long runs collapsed.
+        start, end = self.getExtent()
+        f = open(filename+'.txt',"w", encoding='utf-8')
+        if end - start > REPORT_LONG_TAPE:
+            self.writeWorkspace(f, REPORT_LINE_CELLS, REPORT_RUN_CELLS)
+        else:
+            self.writeWorkspace(f)
+        f.close()
+
+    # Count each symbol from the first to the last non blank (non zero) cell on
+    # the tape. Returns a dictionary keyed by symbol, with 'b' for the boundary.
+    # The blanks are the cells in between that are not counted by symbolCounts.
+    def countSymbols(self):
+        start, end = self.getExtent()
+        counts = {'0': end - start - self.getSigma()}
+        for value in range(1, 5):
+            counts[str(value)] = self.symbolCounts[value]
+        counts['b'] = self.symbolCounts[5]
+        return counts
+
+    # Create a text report with the current tape and state machine information.
+    # See writeWorkspace() for the options.
+    def dumpWorkspace(self, lineCells=None, runCells=None):
+        workspace = io.StringIO()
+        self.writeWorkspace(workspace, lineCells, runCells)
+        return workspace.getvalue()
+
+    # Write the text report to the open file passed. The tape is written a chunk
+    # of cells at a time, so a long tape is never held as text. With lineCells
+    # the tape is wrapped into lines of that many cells, and with runCells each
+    # run of at least that many of the same symbol is shown as one cell, such as
+    # '0×12345'.
+    def writeWorkspace(self, f, lineCells=None, runCells=None):
+        tape = self.tape
+        stateTable = self.stateTable
+
+        # Find the positions of the first and last non zero symbols on the tape.
+        start, end = self.getExtent()
+
+        # Show the range of non blank (zero) cells.
+        title = "Showing tape from cell {0} to cell {1}.".format(start-self.tapeOrigin, end-1-self.tapeOrigin)
+        f.write(title + '\n' + '~' * len(title) + '\n')
+
+        # Show the tape.
+        if runCells != None:
+            # A search for each symbol, which starts with a fast search for
+            # runCells of the symbol.
+            longRuns = [re.compile(symbol * runCells + symbol + '*') for symbol in '01234b']
+        line = []
+        written = False
+        pos = start
+        while pos < end:
+            stop = min(end, pos + REPORT_CHUNK_CELLS)
+            if runCells != None and stop < end:
+                # Take in the rest of a run the chunk ends part way through.
+                stop += skipRun(tape, stop, 1, end - 1, tape[stop-1])
+            text = tape[pos:stop].translate(REPORT_SYMBOLS).decode()
+            pos = stop
+            if runCells == None:
+                cells = list(text)
+            else:
+                cells = []
+                last = 0
+                runs = sorted(run.span() for longRun in longRuns for run in longRun.finditer(text))
+                for runStart, runEnd in runs:
+                    cells.extend(text[last:runStart])
+                    cells.append(text[runStart] + '\u00d7' + str(runEnd - runStart))
+                    last = runEnd
+                cells.extend(text[last:])
+            if lineCells == None:
+                # All on one line.
+                if written:
+                    f.write(' | ')
+                else:
+                    f.write('| ')
+                f.write(' | '.join(cells))
+                written = True
+                continue
+            line.extend(cells)
+            first = 0
+            while len(line) - first >= lineCells:
+                f.write('| ' + ' | '.join(line[first:first+lineCells]) + ' |\n')
+                first += lineCells
+                written = True
+            line = line[first:]
+        if line:
+            f.write('| ' + ' | '.join(line) + ' |\n')
+        elif lineCells == None and written:
+            f.write(' |\n')
+        elif not written:
+            f.write('|\n')
+
+        # Show the number of each symbol.
+        f.write('\nCounts\n~~~~~~\n')
+        for key, value in self.countSymbols().items():
+            f.write(key + ': ' + str(value) + '\n')
+
+        f.write('\nState Transition Table\n~~~~~~~~~~~~~~~~~~~~~~\n')
+        for state in STATES:
+            f.write('          '+state+'\n')
+            for row in range(0, 4):
+                for col in range(0,5):
+                    value = stateTable[state+str(col)][row]
+                    if value == ' ':
+                        value = '-'
+                    f.write('| ' + value + ' ')
+                f.write('|\n')
+            f.write('\n')
+
+        # Show how often each transition has fired, if profiling.
+        hits = self.getHits()
+        if hits != None:
+            total = max(1, sum(hits.values()))
+            f.write('Transition Counts\n~~~~~~~~~~~~~~~~~\n')
+            f.write('   ' + ''.join('{0:>12}'.format(symbol) for symbol in SYMBOLS) + '       Steps\n')
+            for state, steps in self.getStateSteps().items():
+                f.write(state + ': ' + ''.join('{0:>12,}'.format(hits[state+symbol]) for symbol in SYMBOLS))
+                f.write('{0:>12,} {1:5.1f}%\n'.format(steps, 100.0 * steps / total))
+            f.write('\n')
+
+    # Read the symbol at the tape head position and determine the transition tuple.
+    # Returns False if the transition is not defined.
+    def readTransition(self):
+        value = self.tape[self.tapeHead]
+        self.hitIndex = STATES.index(self.currentState) * TABLE_STRIDE + value
+        if value == 5:
+            self.currentTransition = self.stateTable[self.currentState+'4']
+        else:
+            self.currentTransition = self.stateTable[self.currentState+str(value)]
+        transition = self.currentTransition
+        if transition[1] == ' ' or transition[2] == ' ' or transition[3] == ' ':
+            return False
+        return True
+
+    # Update the tape with the new value. If is 'b' don't write.
+    def writeSymbol(self):
+        if self.currentTransition[1] != 'b':
+            self.writeCell(self.tapeHead, int(self.currentTransition[1]))
+
+    # True if the current transition would move the head past a 'b' boundary.
+    def atBoundary(self):
+        return self.currentTransition[0] == 'b' and self.currentTransition[2] == self.lastMoveDirection
+
+    # Move the tape, growing it if the head gets near either end, and record
+    # the move direction.
+    def moveHead(self):
+        if self.currentTransition[2] != 'R':
+            self.shiftHead(1)
+        else:
+            self.shiftHead(-1)
+        self.touchTape(self.tapeHead, self.tapeHead + 1)
+        self.lastMoveDirection = self.currentTransition[2]
+
+    # Set the new state. Returns False if the machine halted.
+    def gotoState(self):
+        self.steps += 1
+        self.metrics.sample(self.steps)
+        if self.hits != None and self.hitIndex != None:
+            self.hits[self.hitIndex] += 1
+        self.hitIndex = None
+        if self.currentTransition[3] == 'H':
+            return False
+        self.currentState = self.currentTransition[3]
+        return True
+
+    # Return the throughput counters as a dictionary. See RunMetrics.
+    def getMetrics(self):
+        return self.metrics.snapshot(self.steps)
+
+    # Run the state machine until it halts. The optional poll function is
+    # called about every POLL_INTERVAL seconds, with tapeHead, currentState and
+    # the symbol counts showing where the run is up to, and stops the run if it
+    # returns True.
+    # The optional decider (see tmd3Decider.py) is checked every
+    # decider.interval transitions and stops the run if it proves the machine
+    # never halts. The run also stops after maxSteps transitions or, checked
+    # at each poll, once maxTime seconds have passed. If a TraceRecorder (see
+    # tmd3Trace.py) is passed as trace every transition is recorded to it, and
+    # while profiling (see startProfile()) every transition is counted. Returns
+    # a RunResult.
+    def runFast(self, poll=None, decider=None, maxSteps=None, maxTime=None, trace=None):
+        table = CompiledTable(self.stateTable)
+        writes = table.writes
+        moves = table.moves
+        nexts = table.nexts
+        gotos = table.gotos
+        tape = self.tape
+        head = self.tapeHead
+        cell = head - self.tapeOrigin
+        right = len(tape) - 1 - TAPE_MARGIN
+
+        # The inner loops do not keep the symbol counts. Only the cells within
+        # maxSteps of the head can change, so they are counted now and again at
+        # the end of the run. Polls bring the counts up to date and count the
+        # cells within reach of the head before the next poll instead.
+        countCell = cell
+        countLoops = 0
+        countReach = maxSteps
+        counts = self.countCells(*self.reachCells(countCell, countReach))
+        base = STATES.index(self.currentState) * TABLE_STRIDE
+        delta = MOVE_DELTAS[self.lastMoveDirection]
+        idx = None
+
+        start = time.perf_counter()
+        metrics = self.metrics
+        metrics.startRun(self.steps, start)
+        reason = None
+        certificate = None
+        loops = 0
+        nextPoll = FIRST_POLL_LOOPS
+        lastPoll = start
+        lastPollLoops = 0
+        if decider != None:
+            decider.reset()
+            nextDecide = decider.interval
+
+        # Traced and profiled runs take an instrumented path that records each
+        # transition into the trace buffer and counts it as a hit on its table
+        # entry. Whichever is not wanted goes into a scratch buffer or list.
+        instrumented = trace != None or self.hits != None
+        if instrumented:
+            hits = self.hits
+            if hits == None:
+                hits = [0] * len(table.writes)
+            if trace != None:
+                codes = trace.start(self, table)
+                records = trace.records
+            else:
+                codes = bytes(len(table.writes))
+                records = bytearray()
+        nextStop = 0
+        try:
+            while True:
+                if loops >= nextStop:
+                    # Stop when the step budget runs out.
+                    if maxSteps != None and loops >= maxSteps:
+                        reason = 'budget'
+                        break
+
+                    # Periodically check for a proof that the machine never halts.
+                    if decider != None and loops >= nextDecide:
+                        nextDecide = loops + decider.interval
+                        certificate = decider.check(tape, self.tapeOrigin, head, STATES[base // TABLE_STRIDE], delta, self.steps + loops)
+                        if certificate != None:
+                            reason = 'non-halting'
+                            break
+
+                    # Periodically check the time budget and let the caller
+                    # check for a halt request.
+                    if loops >= nextPoll:
+                        now = time.perf_counter()
+                        metrics.sample(self.steps + loops, now)
+                        if maxTime != None and now - start >= maxTime:
+                            reason = 'budget'
+                            break
+                        nextPoll = loops + pollChunk(loops - lastPollLoops, now - lastPoll)
+                        if poll != None:
+                            # Let the poll function see where the run is up to.
+                            self.tapeHead = head
+                            self.currentState = STATES[base // TABLE_STRIDE]
+                            self.touchReach(countCell, loops - countLoops)
+                            self.recountCells(counts, *self.reachCells(countCell, countReach))
+                            countCell = head - self.tapeOrigin
+                            countLoops = loops
+                            countReach = nextPoll - loops
+                            if maxSteps != None:
+                                countReach = min(countReach, maxSteps - loops)
+                            counts = self.countCells(*self.reachCells(countCell, countReach))
+                            if metrics.callPoll(poll):
+                                reason = 'user'
+                                break
+                        lastPoll = time.perf_counter()
+                        lastPollLoops = loops
+
+                    # Write out the trace buffer when it is full.
+                    if instrumented and trace == None:
+                        del records[:]
+                    elif trace != None and len(records) >= trace.chunkSteps:
+                        self.tapeHead = head
+                        self.currentState = STATES[base // TABLE_STRIDE]
+                        self.lastMoveDirection = MOVE_DIRECTIONS[delta]
+                        self.touchReach(cell, loops)
+                        trace.newChunk(self, self.steps + loops)
+                    nextStop = nextPoll
+                    if decider != None:
+                        nextStop = min(nextStop, nextDecide)
+                    if maxSteps != None:
+                        nextStop = min(nextStop, maxSteps)
+                    if trace != None:
+                        nextStop = min(nextStop, loops + trace.chunkSteps - len(records))
+
+                # The head moves one cell per transition, so this many can be
+                # made without checking for the ends of the tape.
+                count = min(head - TAPE_MARGIN, right - head, nextStop - loops)
+                if count > 0 and not instrumented:
+                    for i in range(count):
+                        idx = base + tape[head]
+                        nxt = nexts[idx]
+                        if nxt < 0:
+                            break
+                        tape[head] = writes[idx]
+                        delta = moves[idx]
+                        head += delta
+                        base = nxt
+                    else:
+                        i = count
+                    loops += i
+                    if i == count:
+                        continue
+                elif count > 0:
+                    # The same, recording and counting each transition.
+                    for i in range(count):
+                        idx = base + tape[head]
+                        nxt = nexts[idx]
+                        if nxt < 0:
+                            break
+                        tape[head] = writes[idx]
+                        records.append(codes[idx])
+                        hits[idx] += 1
+                        delta = moves[idx]
+                        head += delta
+                        base = nxt
+                    else:
+                        i = count
+                    loops += i
+                    if i == count:
+                        continue
+
+                # Make a single transition with all of the checks.
+                idx = base + tape[head]
+                goto = gotos[idx]
+
+                # Check for invalid state transition table.
+                if goto == UNDEFINED:
+                    self.currentStep = 'READ'
+                    reason = 'undefined'
+                    break
+
+                # Write. A 'b' compiles to writing the symbol read.
+                tape[head] = writes[idx]
+
+                # Move. Check for boundary conditions.
+                move = moves[idx]
+                if nexts[idx] == BOUNDARY and move == delta:
+                    # Cannot go past a boundary.
+                    self.currentStep = 'MOVE'
+                    reason = 'boundary'
+                    break
+                delta = move
+                head += delta
+                if head < TAPE_MARGIN or head > right:
+                    # Near the end of the tape, so add more.
+                    self.tapeHead = head
+                    self.shiftHead(0)
+                    head = self.tapeHead
+                    right = len(tape) - 1 - TAPE_MARGIN
+
+                # Goto. Set the new state.
+                loops += 1
+                if instrumented:
+                    records.append(codes[idx])
+                    hits[idx] += 1
+                if goto == HALT:
+                    self.currentStep = 'GOTO'
+                    reason = 'halted'
+                    break
+                base = goto
+
+                # A transition back to the same state keeps sweeping the head
+                # across the run of the symbol just read. Skip the whole run,
+                # stopping short of the ends of the tape so the checked path
+                # grows it and at the next poll or decider check.
+                if nexts[idx] == SELF_LOOP:
+                    symbol = idx - base
+                    if delta > 0:
+                        last = min(right - 1, head + nextStop - loops - 1)
+                    else:
+                        last = max(TAPE_MARGIN + 1, head - nextStop + loops + 1)
+                    count = skipRun(tape, head, delta, last, symbol)
+                    if count > 0:
+                        write = writes[idx]
+                        if delta > 0:
+                            if write != symbol:
+                                tape[head:head+count] = bytes((write,)) * count
+                            head += count
+                        else:
+                            if write != symbol:
+                                tape[head-count+1:head+1] = bytes((write,)) * count
+                            head -= count
+                        loops += count
+                        if instrumented:
+                            hits[idx] += count
+                            if trace != None:
+                                records.extend(codes[idx:idx+1] * count)
+
+            if reason in ('budget', 'user', 'non-halting'):
+                # Stopped between transitions, so running again carries on
+                # from here.
+                idx = None
+                self.currentStep = 'READ'
+        finally:
+            self.steps += loops
+            metrics.endRun(self.steps)
+            self.tapeHead = head
+            self.touchReach(countCell, loops - countLoops)
+            self.recountCells(counts, *self.reachCells(countCell, countReach))
+            self.currentState = STATES[base // TABLE_STRIDE]
+            self.lastMoveDirection = MOVE_DIRECTIONS[delta]
+            if idx == None:
+                self.currentTransition = None
+            else:
+                self.currentTransition = table.transitions[idx]
+        return RunResult(reason, loops, time.perf_counter() - start, certificate)
+
+# The outcome of a run. reason is 'halted', 'undefined' (an undefined
+# transition was found), 'boundary' (the head would have crossed a 'b'
+# boundary), 'budget' (the step or time budget ran out), 'user' (the poll
+# function asked to stop) or 'non-halting' (the decider proved the machine never
+# halts and certificate holds its proof). steps is the number of transitions
+# made and elapsed the run time in seconds. After 'budget', 'user' or
+# 'non-halting' the machine can be run again from where it stopped.
+class RunResult():
+
+    def __init__(self, reason, steps, elapsed, certificate=None):
+        self.reason = reason
+        self.steps = steps
+        self.elapsed = elapsed
+        self.certificate = certificate
+
+# Throughput counters for a machine. The engines only update them at their poll
+# checks, so they cost nothing in the inner loops, and the console adds the time
+# it spends rendering. The halt latency is the longest a halt request could
+# have waited: the time from the poll before the one that saw it to the stop.
+class RunMetrics():
+
+    def __init__(self):
+        # (time, steps) samples, oldest first.
+        self.samples = collections.deque(maxlen=METRICS_SAMPLES)
+        self.pollTime = 0.0
+        self.polls = 0
+        self.renderTime = 0.0
+        self.frames = 0
+        self.haltLatency = None
+        self.lastPoll = None
+        self.running = False
+
+    # Record that the machine had made steps transitions at time now.
+    def sample(self, steps, now=None):
+        if now == None:
+            now = time.perf_counter()
+        self.samples.append((now, steps))
+
+    # Called by the engines at the start and the end of each run.
+    def startRun(self, steps, now):
+        self.sample(steps, now)
+        self.lastPoll = now
+        self.running = True
+
+    def endRun(self, steps):
+        self.sample(steps)
+        self.running = False
+
+    # Call the poll function passed, timing it. Returns what it returns.
+    def callPoll(self, poll):
+        now = time.perf_counter()
+        stop = poll()
+        finished = time.perf_counter()
+        self.pollTime += finished - now
+        self.polls += 1
+        if stop:
+            self.haltLatency = finished - self.lastPoll
+        self.lastPoll = finished
+        return stop
+
+    # Add the time taken to draw a frame.
+    def addRender(self, seconds):
+        self.renderTime += seconds
+        self.frames += 1
+
+    # Return the transitions per second over the last METRICS_WINDOW seconds.
+    def stepsPerSecond(self):
+        samples = self.samples
+        while len(samples) > 2 and samples[-1][0] - samples[1][0] >= METRICS_WINDOW:
+            samples.popleft()
+        if len(samples) < 2 or samples[-1][0] <= samples[0][0]:
+            return 0.0
+        return (samples[-1][1] - samples[0][1]) / (samples[-1][0] - samples[0][0])
+
+    # Return the counters as a dictionary, with steps the total transitions made
+    # (as of the last sample while a run is going on).
+    def snapshot(self, steps):
+        if self.running:
+            steps = self.samples[-1][1]
+        metrics = {}
+        metrics['steps'] = steps
+        metrics['stepsPerSecond'] = self.stepsPerSecond()
+        metrics['pollTime'] = self.pollTime
+        metrics['polls'] = self.polls
+        metrics['renderTime'] = self.renderTime
+        metrics['frames'] = self.frames
+        metrics['haltLatency'] = self.haltLatency
+        return metrics
+
+# The state transition table compiled into flat lists indexed by
+# state*TABLE_STRIDE+symbol, where symbol is the raw tape value (5 is 'b').
+# Each entry holds the symbol to write, the head delta and the base index of the
+# next state. Transitions that need more than a plain write, move and goto have
+# a negative code in nexts so the fast loop can drop out to the checked path.
+class CompiledTable():
+
+    def __init__(self, stateTable):
+        size = len(STATES) * TABLE_STRIDE
+        self.writes = [0] * size
+        self.moves = [0] * size
+        self.nexts = [UNDEFINED] * size
+        self.gotos = [UNDEFINED] * size
+        self.transitions = [None] * size
+
+        for state in range(len(STATES)):
+            for symbol in range(TABLE_STRIDE):
+                # The 'b' symbol shares the '4' column.
+                transition = stateTable[STATES[state]+SYMBOLS[min(symbol, 4)]]
+                idx = state * TABLE_STRIDE + symbol
+                self.transitions[idx] = transition
+                if transition[1] == ' ' or transition[2] == ' ' or transition[3] == ' ':
+                    continue
+                write, move, goto = transition[1:4]
+                if write == 'b':
+                    self.writes[idx] = symbol
+                elif write in SYMBOLS:
+                    self.writes[idx] = int(write)
+                else:
+                    continue
+                if move == 'R':
+                    self.moves[idx] = -1
+                else:
+                    self.moves[idx] = 1
+                if goto == 'H':
+                    self.gotos[idx] = HALT
+                elif goto in STATES:
+                    self.gotos[idx] = STATES.index(goto) * TABLE_STRIDE
+                else:
+                    continue
+                if transition[0] == 'b':
+                    self.nexts[idx] = BOUNDARY
+                elif self.gotos[idx] == state * TABLE_STRIDE:
+                    self.nexts[idx] = SELF_LOOP
+                else:
+                    self.nexts[idx] = self.gotos[idx]
+
+# Return the number of loops to run before the next poll, given that the last
+# loops took elapsed seconds (not counting the poll itself). The chunk changes by
+# at most a factor of four each time so one unusual chunk does not throw it off.
+def pollChunk(loops, elapsed):
+    if elapsed > 0:
+        scale = min(4.0, max(0.25, POLL_INTERVAL / elapsed))
+    else:
+        scale = 4.0
+    return min(MAX_POLL_LOOPS, max(MIN_POLL_LOOPS, int(loops * scale)))
+
+# Count the cells holding symbol from pos in the direction of delta, up to and
+# including cell last, before a different symbol is found.
+def skipRun(tape, pos, delta, last, symbol):
+    pattern = bytes((symbol,))
+    count = 0
+    window = RUN_SCAN_WINDOW
+    if delta > 0:
+        while pos + count <= last:
+            end = min(pos + count + window, last + 1)
+            chunk = tape[pos+count:end]
+            skipped = len(chunk) - len(chunk.lstrip(pattern))
+            count += skipped
+            if skipped < len(chunk):
+                break
+            window *= 2
+    else:
+        while pos - count >= last:
+            start = max(pos - count - window + 1, last)
+            chunk = tape[start:pos-count+1]
+            skipped = len(chunk) - len(chunk.rstrip(pattern))
+            count += skipped
+            if skipped < len(chunk):
+                break
+            window *= 2
+    return count
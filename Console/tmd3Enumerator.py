@@ -0,0 +1,253 @@
+# Busy beaver enumerator for the TMD-3 state transition table space.
+#
+# Tables are generated in tree normal form: a machine is run from a blank tape
+# until it reaches a transition that is not defined yet, then one child table
+# is made for each way of defining that transition and each child carries on
+# from there. New states and symbols are only brought in one at a time in order
+# and the first move is always to the right, so tables that differ only by
+# relabeling states or symbols, or by mirroring the tape, are generated once.
+# Each time an undefined transition is reached the table could halt there
+# instead, which makes it a busy beaver candidate.
+#
+# The top of the tree is split into subtrees that are searched across a pool of
+# worker processes. Progress is saved to the checkpoint file after each subtree
+# so an interrupted search carries on from where it stopped, and the champions
+# are written out as .tmd3 files. For example:
+#
+#   python tmd3Enumerator.py --states 4 --symbols 2 --checkpoint bb42.json --output champions
+import argparse
+import json
+import multiprocessing
+import os
+import tmd3Engine
+import tmd3Decider
+from tmd3Engine import STATES, SYMBOLS
+
+##### Globals
+# Most transitions run for each table unless --steps is given.
+DEFAULT_MAX_STEPS = 100000
+
+# How many champions are kept for each score.
+DEFAULT_CHAMPIONS = 5
+
+# The top of the tree is split until there are this many subtrees per worker.
+SPLIT_JOBS = 16
+
+# Transitions between decider checks. Most small tables that never halt cycle
+# early, so they are checked more often than in the console.
+DECIDER_INTERVAL = 1000
+
+##### Functions and classes.
+# True if all of the fields of the transition passed are filled in.
+def isDefined(transition):
+    return transition[1] != ' ' and transition[2] != ' ' and transition[3] != ' '
+
+# Return the defined transitions of the state transition table passed.
+def definedEntries(stateTable):
+    return {key: list(transition) for key, transition in stateTable.items() if isDefined(transition)}
+
+# Return a machine at the start of a blank tape with the transitions passed.
+def newMachine(entries):
+    machine = tmd3Engine.Machine()
+    for key, transition in entries.items():
+        machine.stateTable[key] = list(transition)
+    return machine
+
+# Return a new, empty set of search results.
+def newResults():
+    results = {}
+    results['tables'] = 0
+    results['halting'] = 0
+    results['non-halting'] = 0
+    results['holdouts'] = 0
+    results['champions'] = {'steps': [], 'nonblank': []}
+    return results
+
+# Add the champion passed to the list for score, keeping the best limit.
+def addChampion(champions, score, champion, limit):
+    if score == 'steps':
+        rank = lambda entry: (entry['steps'], entry['nonblank'])
+    else:
+        rank = lambda entry: (entry['nonblank'], entry['steps'])
+    champions.append(champion)
+    champions.sort(key=rank, reverse=True)
+    del champions[limit:]
+
+# Add the totals and champions of results to those of total.
+def mergeResults(total, results, limit):
+    for key in ('tables', 'halting', 'non-halting', 'holdouts'):
+        total[key] += results[key]
+    for score, champions in results['champions'].items():
+        for champion in champions:
+            addChampion(total['champions'][score], score, champion, limit)
+
+# Record the machine passed, stopped at an undefined transition, as a candidate
+# that halts there. The halting transition writes a 1 to score the most cells.
+def recordCandidate(machine, settings, results):
+    value = machine.tape[machine.tapeHead]
+    write = '1' if settings['symbols'] > 1 else '0'
+    nonblank = machine.getSigma()
+    if value == 0 and write != '0':
+        nonblank += 1
+    champion = {'steps': machine.steps + 1, 'nonblank': nonblank}
+    limit = settings['champions']
+    for score, champions in results['champions'].items():
+        # Only build the table for candidates that make the list.
+        if len(champions) < limit or champion[score] >= champions[-1][score]:
+            if 'table' not in champion:
+                table = definedEntries(machine.stateTable)
+                table[machine.currentState + SYMBOLS[value]] = [SYMBOLS[value], write, 'R', 'H']
+                champion['table'] = table
+            addChampion(champions, score, champion, limit)
+
+# Return the children of the machine passed, stopped at an undefined transition,
+# as (machine, key, transition) tuples. Each child is the machine with that
+# transition defined.
+def childSpecs(machine, settings):
+    states = STATES[:settings['states']]
+    symbols = SYMBOLS[:settings['symbols']]
+    defined = [transition for transition in machine.stateTable.values() if isDefined(transition)]
+
+    # At least one transition has to be left undefined to halt on.
+    if len(defined) + 1 >= len(states) * len(symbols):
+        return []
+
+    # New states and symbols are brought in in order, one at a time.
+    usedStates = max([1] + [STATES.index(transition[3]) + 1 for transition in defined if transition[3] in STATES])
+    usedSymbols = max([1] + [int(transition[1]) + 1 for transition in defined])
+    gotos = states[:usedStates+1]
+    writes = symbols[:usedSymbols+1]
+    moves = ('L', 'R')
+    if not defined:
+        # The first transition moves right into a new state. Going back to A
+        # would repeat it on the blank tape forever.
+        moves = ('R',)
+        gotos = states[1:2] or states[:1]
+
+    value = machine.tape[machine.tapeHead]
+    key = machine.currentState + SYMBOLS[value]
+    specs = []
+    for goto in gotos:
+        for write in writes:
+            for move in moves:
+                specs.append((machine, key, [SYMBOLS[value], write, move, goto]))
+    return specs
+
+# Return the machine for the child spec passed.
+def makeChild(spec):
+    parent, key, transition = spec
+    machine = parent.copy()
+    machine.stateTable[key] = transition
+    return machine
+
+# Run the machine passed on until it halts, is proved never to halt or uses up
+# its step budget, recording the outcome in results. Returns its child specs.
+def runNode(machine, settings, results):
+    decider = None
+    if settings['deciders']:
+        decider = tmd3Decider.CycleDecider(interval=DECIDER_INTERVAL)
+    result = machine.runFast(None, decider, max(0, settings['steps'] - machine.steps))
+    results['tables'] += 1
+    if result.reason == 'non-halting':
+        results['non-halting'] += 1
+        return []
+    if result.reason != 'undefined':
+        results['holdouts'] += 1
+        return []
+    results['halting'] += 1
+    recordCandidate(machine, settings, results)
+    return childSpecs(machine, settings)
+
+# Search the subtree below the transitions passed, depth first. Called in the
+# worker processes with an (entries, settings) tuple, returns (entries, results).
+def searchTree(job):
+    entries, settings = job
+    results = newResults()
+    stack = [(newMachine(entries), None, None)]
+    while stack:
+        spec = stack.pop()
+        if spec[1] == None:
+            machine = spec[0]
+        else:
+            machine = makeChild(spec)
+        stack.extend(runNode(machine, settings, results))
+    return entries, results
+
+# Search the top of the tree breadth first until there are at least jobs
+# subtrees left. Returns the transitions of each subtree and the results for
+# the tables searched so far.
+def splitTree(settings, jobs):
+    results = newResults()
+    frontier = [{}]
+    while frontier and len(frontier) < jobs:
+        nextFrontier = []
+        for entries in frontier:
+            for machine, key, transition in runNode(newMachine(entries), settings, results):
+                child = dict(entries)
+                child[key] = transition
+                nextFrontier.append(child)
+        frontier = nextFrontier
+    return frontier, results
+
+# Save the checkpoint passed, replacing the old one only once it is written.
+def saveCheckpoint(filename, checkpoint):
+    f = open(filename + '.tmp', 'w')
+    f.write(json.dumps(checkpoint))
+    f.close()
+    os.replace(filename + '.tmp', filename)
+
+# Save each champion as a .tmd3 file (and .txt report) in the directory passed.
+def writeChampions(directory, champions):
+    os.makedirs(directory, exist_ok=True)
+    for score, entries in champions.items():
+        for rank, champion in enumerate(entries):
+            machine = newMachine(champion['table'])
+            machine.saveWorkspace(os.path.join(directory, '{0}-{1:02d}'.format(score, rank+1)))
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Enumerate TMD-3 state transition tables for busy beaver candidates.')
+    parser.add_argument('--states', type=int, default=len(STATES), choices=range(1, len(STATES)+1), help='number of states to use')
+    parser.add_argument('--symbols', type=int, default=len(SYMBOLS), choices=range(1, len(SYMBOLS)+1), help='number of symbols to use')
+    parser.add_argument('--steps', type=int, default=DEFAULT_MAX_STEPS, help='most transitions for each table')
+    parser.add_argument('--champions', type=int, default=DEFAULT_CHAMPIONS, help='how many champions to keep for each score')
+    parser.add_argument('--no-deciders', dest='deciders', action='store_false', help='do not stop tables proved never to halt')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes, by default one per core')
+    parser.add_argument('--checkpoint', help='file to save progress to and resume from')
+    parser.add_argument('--output', default='champions', help='directory to write the champion .tmd3 files to')
+    options = parser.parse_args(args)
+    workers = options.workers or os.cpu_count() or 1
+
+    if options.checkpoint != None and os.path.exists(options.checkpoint):
+        # Carry on with the search saved in the checkpoint.
+        f = open(options.checkpoint, 'r')
+        checkpoint = json.loads(f.read())
+        f.close()
+        print('Resuming from {0} with {1} subtrees left.'.format(options.checkpoint, len(checkpoint['pending'])))
+    else:
+        settings = {'states': options.states, 'symbols': options.symbols, 'steps': options.steps,
+                    'champions': options.champions, 'deciders': options.deciders}
+        pending, results = splitTree(settings, workers * SPLIT_JOBS)
+        checkpoint = {'settings': settings, 'pending': pending, 'results': results}
+    settings = checkpoint['settings']
+    pending = checkpoint['pending']
+    results = checkpoint['results']
+
+    total = len(pending)
+    jobs = [(entries, settings) for entries in pending]
+    with multiprocessing.Pool(max(1, min(workers, len(jobs)))) as pool:
+        for done, (entries, subtreeResults) in enumerate(pool.imap_unordered(searchTree, jobs)):
+            pending.remove(entries)
+            mergeResults(results, subtreeResults, settings['champions'])
+            if options.checkpoint != None:
+                saveCheckpoint(options.checkpoint, checkpoint)
+            print('{0}/{1} subtrees, {2} tables.'.format(done+1, total, results['tables']))
+
+    writeChampions(options.output, results['champions'])
+    print('Tables: {0}  Halting: {1}  Non-halting: {2}  Holdouts: {3}'.format(
+        results['tables'], results['halting'], results['non-halting'], results['holdouts']))
+    for score, champions in results['champions'].items():
+        if champions:
+            print('Best {0}: {1} steps, {2} non-blank cells.'.format(score, champions[0]['steps'], champions[0]['nonblank']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+# Undo journal for stepping a TMD-3 machine backwards.
+#
+# Each transition made a phase at a time (STEP and DEMO mode) is recorded as a
+# single byte holding the state and the symbol it read, the way the head moved
+# and the move before that, which is all that is needed to undo it. The records
+# are kept in a ring buffer, so once it is full the oldest are dropped.
+#
+# Every so often the journal also keeps a snapshot of the whole machine.
+# Rewinding to a step further back than the records reach, or across a run
+# made without the journal (RUN or fast forward), restores the last snapshot
+# before it and replays the rest with runFast(). The journal has to be reset
+# whenever the tape or the state transition table is edited, as the snapshots
+# would no longer replay to the same machine.
+#
+# Run this module on its own to check stepping back after runs made without
+# the journal:
+#
+#   python tmd3Journal.py
+import os
+import sys
+import zlib
+import tmd3Engine
+from tmd3Engine import STATES, MOVE_DELTAS
+
+##### Globals
+# Most records kept. At one byte each this is the journal's memory cap. None
+# keeps every record.
+JOURNAL_CAPACITY = 1 << 20
+
+# Transitions recorded between snapshots.
+JOURNAL_SNAPSHOT_STEPS = 10000
+
+# Most snapshots kept. When there are more, every other one is dropped.
+JOURNAL_SNAPSHOTS = 64
+
+# Rewinds of up to this many transitions undo records rather than replaying
+# from a snapshot, if the records reach back far enough.
+UNDO_STEPS = 10000
+
+# Ring buffer size used when the capacity is None. It doubles when full.
+FIRST_JOURNAL_SIZE = 4096
+
+# The directions in a record.
+DIRECTIONS = ('L', 'R', ' ')
+
+# Directory holding the bundled beaver saves.
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+##### Functions and classes.
+# Pack a record into a byte: the state index and tape value read, the head delta
+# (1 or -1) and the previous move direction.
+def packRecord(state, value, delta, direction):
+    return ((state * 6 + value) * 2 + (delta < 0)) * 3 + DIRECTIONS.index(direction)
+
+# Return (state, value, delta, direction) from a packed record.
+def unpackRecord(record):
+    record, direction = divmod(record, 3)
+    record, negative = divmod(record, 2)
+    state, value = divmod(record, 6)
+    return state, value, -1 if negative else 1, DIRECTIONS[direction]
+
+# The machine at one step: the step count, tape head and cell 0, state and last
+# move direction, and the non blank part of the tape compressed. A snapshot
+# taken part way through a transition is not ready, and cannot be restored.
+class Snapshot():
+
+    def __init__(self, machine, ready=True):
+        self.ready = ready
+        tape = machine.tape
+        start, end = machine.getExtent()
+        self.steps = machine.steps
+        self.cell = machine.tapeHead - machine.tapeOrigin
+        self.start = start - machine.tapeOrigin
+        self.cells = zlib.compress(bytes(tape[start:end]), 1)
+        self.state = machine.currentState
+        self.direction = machine.lastMoveDirection
+
+    # Put the machine passed back to this snapshot, at the READ step.
+    def restore(self, machine):
+        cells = zlib.decompress(self.cells)
+        tape = machine.tape
+        start, end = machine.getExtent()
+        tape[start:end] = bytes(end - start)
+        machine.tapeHead = machine.tapeOrigin + self.cell
+        while machine.tapeOrigin + self.start < 0:
+            machine.growTape(-1)
+        while machine.tapeOrigin + self.start + len(cells) > len(tape):
+            machine.growTape(1)
+        start = machine.tapeOrigin + self.start
+        tape[start:start+len(cells)] = cells
+        machine.tapeHead = machine.tapeOrigin + self.cell
+        machine.shiftHead(0)
+        machine.touchTape(start, start + len(cells))
+        machine.touchTape(machine.tapeHead, machine.tapeHead + 1)
+        machine.recount()
+        machine.steps = self.steps
+        machine.currentState = self.state
+        machine.lastMoveDirection = self.direction
+        machine.currentStep = 'READ'
+        machine.currentTransition = None
+
+class Journal():
+
+    def __init__(self, capacity=JOURNAL_CAPACITY, snapshotSteps=JOURNAL_SNAPSHOT_STEPS):
+        self.capacity = capacity
+        self.snapshotSteps = snapshotSteps
+        self.records = bytearray(capacity or FIRST_JOURNAL_SIZE)
+        self.first = 0
+        self.count = 0
+        self.snapshots = []
+        self.steps = None
+        self.pending = None
+
+    # Forget everything and start again from the machine passed.
+    def reset(self, machine):
+        self.first = 0
+        self.count = 0
+        self.snapshots = []
+        self.pending = None
+        self.takeSnapshot(machine, machine.currentStep == 'READ')
+
+    # Keep a snapshot of the machine passed.
+    def takeSnapshot(self, machine, ready=True):
+        self.snapshots.append(Snapshot(machine, ready))
+        self.steps = machine.steps
+        if len(self.snapshots) > JOURNAL_SNAPSHOTS:
+            self.snapshots = self.snapshots[:1] + self.snapshots[2:-1:2] + self.snapshots[-1:]
+
+    # Catch up with transitions made without the journal. The records cannot
+    # undo past them, so they are dropped, and a snapshot is taken so rewinds
+    # can replay up to here. runFast() always stops between transitions.
+    def sync(self, machine):
+        if machine.steps != self.steps:
+            self.first = 0
+            self.count = 0
+            self.pending = None
+            self.snapshots = [snapshot for snapshot in self.snapshots if snapshot.steps < machine.steps]
+            self.takeSnapshot(machine)
+
+    # Called at the READ step of a transition, before the symbol is read.
+    def begin(self, machine):
+        self.sync(machine)
+        self.pending = (machine.tapeHead - machine.tapeOrigin, machine.tape[machine.tapeHead],
+                        STATES.index(machine.currentState), machine.lastMoveDirection)
+
+    # Called once the transition begun has set the new state.
+    def commit(self, machine):
+        if self.pending == None:
+            return
+        cell, value, state, direction = self.pending
+        self.pending = None
+        self.push(packRecord(state, value, MOVE_DELTAS[machine.lastMoveDirection], direction))
+        self.steps = machine.steps
+        if machine.steps - self.snapshots[-1].steps >= self.snapshotSteps:
+            self.takeSnapshot(machine)
+
+    # Add a record, dropping the oldest if the ring buffer is full.
+    def push(self, record):
+        size = len(self.records)
+        if self.count == size:
+            if self.capacity == None:
+                # Unwrap the ring into a buffer twice the size.
+                self.records = self.records[self.first:] + self.records[:self.first] + bytearray(size)
+                self.first = 0
+                size *= 2
+            else:
+                self.first = (self.first + 1) % size
+                self.count -= 1
+        self.records[(self.first + self.count) % size] = record
+        self.count += 1
+
+    # Remove and return the newest record.
+    def pop(self):
+        self.count -= 1
+        return self.records[(self.first + self.count) % len(self.records)]
+
+    # Undo the newest record on the machine passed.
+    def undo(self, machine):
+        state, value, delta, direction = unpackRecord(self.pop())
+        machine.tapeHead -= delta
+        machine.writeCell(machine.tapeHead, value)
+        machine.shiftHead(0)
+        machine.currentState = STATES[state]
+        machine.lastMoveDirection = direction
+        machine.steps -= 1
+
+    # Forget the transition begun but not committed. Call when the machine is
+    # run on from part way through it without the journal.
+    def dropPending(self):
+        self.pending = None
+
+    # Put back what the transition begun but not committed has changed.
+    def undoPending(self, machine):
+        cell, value, state, direction = self.pending
+        self.pending = None
+        machine.tapeHead = machine.tapeOrigin + cell
+        machine.writeCell(machine.tapeHead, value)
+        machine.shiftHead(0)
+        machine.currentState = STATES[state]
+        machine.lastMoveDirection = direction
+        machine.currentStep = 'READ'
+        machine.currentTransition = None
+
+    # Step the machine passed back one transition, or back to the READ step
+    # of a transition it is part way through. Returns False if it cannot.
+    def stepBack(self, machine):
+        # A transition begun before a run made without the journal was
+        # finished by the run, so sync() drops it.
+        self.sync(machine)
+        if self.pending != None:
+            self.undoPending(machine)
+            return True
+        if machine.currentStep in ('READ', 'GOTO'):
+            # At GOTO runFast() has halted, and the halt is counted.
+            return self.rewind(machine, machine.steps - 1)
+        # A run stopped at a boundary before making the transition.
+        return self.rewind(machine, machine.steps)
+
+    # Put the machine passed back to the READ step after step transitions. The
+    # newest records are undone if they reach, otherwise the machine is replayed
+    # from the last snapshot before step. Returns False if it cannot go back
+    # that far.
+    def rewind(self, machine, step):
+        if step < 0 or step > machine.steps:
+            return False
+        self.sync(machine)
+        if self.pending != None:
+            self.undoPending(machine)
+        distance = machine.steps - step
+        if distance <= min(self.count, UNDO_STEPS) and (self.count or self.snapshots[-1].ready):
+            for i in range(distance):
+                self.undo(machine)
+        else:
+            before = [snapshot for snapshot in self.snapshots if snapshot.steps <= step and snapshot.ready]
+            if not before:
+                return False
+            before[-1].restore(machine)
+            if step > machine.steps:
+                # Replayed transitions have been counted already.
+                hits = machine.hits
+                machine.hits = None
+                machine.runFast(maxSteps=step - machine.steps)
+                machine.hits = hits
+            # Records for the transitions up to step still hold.
+            self.count = max(0, self.count - distance)
+        machine.currentStep = 'READ'
+        machine.currentTransition = None
+        self.snapshots = [snapshot for snapshot in self.snapshots if snapshot.steps <= step]
+        self.steps = step
+        return True
+
+# Return (steps, head cell, state, non blank tape) of the machine passed.
+def machineKey(machine):
+    return (machine.steps, machine.tapeHead - machine.tapeOrigin, machine.currentState,
+            bytes(machine.tape).strip(b'\0'))
+
+# Return the bundled beaver4 save as a new machine, run on for steps transitions.
+def loadBeaver(steps=0):
+    machine = tmd3Engine.Machine()
+    machine.loadWorkspace(os.path.join(DIRECTORY, 'beaver4'))
+    machine.runFast(maxSteps=steps)
+    return machine
+
+# Begin a transition, then run beaver4 to the end without the journal, as
+# switching to RUN part way through a step does. Stepping back and rewinding
+# must start from where the run ended, not put back the transition begun.
+def main():
+    failures = 0
+    for back in ('stepBack', 'rewind'):
+        machine = loadBeaver()
+        journal = Journal()
+        journal.reset(machine)
+        journal.begin(machine)
+        machine.readTransition()
+        machine.runFast()
+        if back == 'stepBack':
+            journal.stepBack(machine)
+        else:
+            journal.rewind(machine, machine.steps - 1)
+        expected = loadBeaver(machine.steps)
+        if machineKey(machine) != machineKey(expected) or machine.steps != 106:
+            failures += 1
+            print('{0} after a run went to step {1}, head at cell {2}, state {3}.'.format(back, machine.steps,
+                  machine.tapeHead - machine.tapeOrigin, machine.currentState))
+    print('{0} failures.'.format(failures))
+    if failures:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
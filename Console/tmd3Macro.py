@@ -0,0 +1,250 @@
+# Macro machine run mode for the TMD-3 engine.
+#
+# The tape is treated as a sequence of k cell blocks (macro symbols) and held
+# as run length encoded stacks on either side of the head. The effect of
+# entering a block in a given state from a given side is simulated once and
+# remembered, so when the head sweeps across a run of identical blocks without
+# changing state the whole run is handled in one operation. The final tape,
+# tape head, state and step count are the same as for Machine.runFast().
+import time
+from tmd3Engine import CompiledTable, STATES, TABLE_STRIDE, TAPE_MARGIN
+from tmd3Engine import BOUNDARY, MOVE_DELTAS, MOVE_DIRECTIONS, RunResult, pollChunk
+
+##### Globals
+# Number of cells in a macro symbol.
+DEFAULT_BLOCK_SIZE = 6
+
+# Most transitions simulated inside one block before it is treated as never
+# leaving it. The plain engine then takes over so the result is still exact.
+BLOCK_STEP_LIMIT = 100000
+
+# Macro operations made before the first call to the poll function. After that
+# the chunks between polls are sized to take tmd3Engine.POLL_INTERVAL.
+FIRST_POLL_MACRO_LOOPS = 1000
+
+##### Functions and classes.
+# Simulate the block passed on its own with the head at offset pos, until the
+# head leaves the block. Returns (block, base, delta, steps) with the new block
+# contents, the base index of the new state, the direction the head left in
+# and the number of transitions made. Returns None if the machine halts, finds
+# an undefined transition or stays in the block.
+def simulateBlock(table, block, base, pos, delta):
+    writes = table.writes
+    moves = table.moves
+    nexts = table.nexts
+    gotos = table.gotos
+    cells = bytearray(block)
+    size = len(cells)
+    limit = min(len(STATES) * size * TABLE_STRIDE ** size, BLOCK_STEP_LIMIT)
+
+    steps = 0
+    while 0 <= pos < size:
+        if steps == limit:
+            return None
+        idx = base + cells[pos]
+        nxt = nexts[idx]
+        if nxt < 0:
+            # Halts and crossed 'b' boundaries are left to the plain engine.
+            if nxt == BOUNDARY and moves[idx] == delta:
+                return None
+            nxt = gotos[idx]
+            if nxt < 0:
+                return None
+        cells[pos] = writes[idx]
+        delta = moves[idx]
+        pos += delta
+        base = nxt
+        steps += 1
+    return bytes(cells), base, delta, steps
+
+# Add count copies of the block passed to the top of a run length stack.
+def pushRun(stack, block, count):
+    if stack and stack[-1][0] == block:
+        stack[-1][1] += count
+    else:
+        stack.append([block, count])
+
+# Return block number index of the tape as bytes. Block 0 starts at the first
+# cell of the tape and any part of a block off either end of the tape is blank.
+def readBlock(tape, index, size):
+    start = index * size
+    if start >= 0 and start + size <= len(tape):
+        return bytes(tape[start:start+size])
+    cells = bytearray(size)
+    for pos in range(max(start, 0), min(start + size, len(tape))):
+        cells[pos-start] = tape[pos]
+    return bytes(cells)
+
+# Write the run length stacks back onto the tape starting at cell first.
+def writeRuns(tape, first, left, right):
+    pos = first
+    for block, count in left:
+        tape[pos:pos+len(block)*count] = block * count
+        pos += len(block) * count
+    for block, count in reversed(right):
+        tape[pos:pos+len(block)*count] = block * count
+        pos += len(block) * count
+
+# Run the machine passed until it halts using blocks of blockSize cells. The
+# optional poll function is called about every POLL_INTERVAL seconds and stops
+# the run if it returns True. The optional decider is only checked once the
+# plain engine has taken over. The step and time budgets are as for
+# Machine.runFast(), and so is the RunResult returned.
+def runMacro(machine, blockSize=DEFAULT_BLOCK_SIZE, poll=None, decider=None, maxSteps=None, maxTime=None):
+    start = time.perf_counter()
+    table = CompiledTable(machine.stateTable)
+    tape = machine.tape
+    k = blockSize
+
+    if k < 1:
+        return machine.runFast(poll, decider, maxSteps, maxTime)
+
+    # Simulate the block under the head from wherever the head is in it.
+    base = STATES.index(machine.currentState) * TABLE_STRIDE
+    delta = MOVE_DELTAS[machine.lastMoveDirection]
+    current = machine.tapeHead // k
+    result = simulateBlock(table, readBlock(tape, current, k), base, machine.tapeHead - current * k, delta)
+    if result == None or (maxSteps != None and result[3] > maxSteps):
+        return machine.runFast(poll, decider, maxSteps, maxTime)
+    block, base, delta, steps = result
+    if delta > 0:
+        current += 1
+
+    # The blocks visited are run length encoded onto stacks to the left and
+    # right of the head, with the top of each stack next to the head. Blocks
+    # lowBlock up to highBlock are on the stacks, the rest are still read from
+    # the tape (or are blank past its ends) when the head first reaches them.
+    left = []
+    right = []
+    if delta > 0:
+        pushRun(left, block, 1)
+        lowBlock = current - 1
+        highBlock = current
+    else:
+        pushRun(right, block, 1)
+        lowBlock = current
+        highBlock = current + 1
+    leftBlocks = current
+
+    memo = {}
+    metrics = machine.metrics
+    metrics.startRun(machine.steps, start)
+    loops = 0
+    nextPoll = FIRST_POLL_MACRO_LOOPS
+    lastPoll = start
+    lastPollLoops = 0
+    reason = None
+    while True:
+        # Periodically check the time budget and let the caller check for a
+        # halt request.
+        loops += 1
+        if loops >= nextPoll:
+            now = time.perf_counter()
+            metrics.sample(machine.steps + steps, now)
+            if maxTime != None and now - start >= maxTime:
+                reason = 'budget'
+                break
+            if poll != None and metrics.callPoll(poll):
+                reason = 'user'
+                break
+            nextPoll = loops + pollChunk(loops - lastPollLoops, now - lastPoll)
+            lastPoll = time.perf_counter()
+            lastPollLoops = loops
+
+        if delta > 0:
+            facing = right
+            behind = left
+        else:
+            facing = left
+            behind = right
+        if not facing:
+            # First visit to the next block.
+            if delta > 0:
+                pushRun(facing, readBlock(tape, highBlock, k), 1)
+                highBlock += 1
+            else:
+                lowBlock -= 1
+                pushRun(facing, readBlock(tape, lowBlock, k), 1)
+
+        block, count = facing[-1]
+        key = (base, block, delta)
+        result = memo.get(key)
+        if result == None:
+            if delta > 0:
+                pos = 0
+            else:
+                pos = k - 1
+            result = simulateBlock(table, block, base, pos, delta)
+            if result == None:
+                result = False
+            memo[key] = result
+        if result == False:
+            # Halts or stays in this block, the plain engine takes over.
+            break
+
+        newBlock, newBase, newDelta, blockSteps = result
+        if newDelta == delta and newBase == base:
+            # Sweeps straight through the run in the same state, as far as the
+            # step budget allows.
+            if maxSteps != None:
+                count = min(count, (maxSteps - steps) // blockSteps)
+                if count == 0:
+                    break
+            if count == facing[-1][1]:
+                facing.pop()
+            else:
+                facing[-1][1] -= count
+            pushRun(behind, newBlock, count)
+            steps += blockSteps * count
+            leftBlocks += count * delta
+            continue
+
+        if maxSteps != None and steps + blockSteps > maxSteps:
+            # The plain engine uses up the rest of the step budget.
+            break
+        if count == 1:
+            facing.pop()
+        else:
+            facing[-1][1] -= 1
+        if newDelta == delta:
+            pushRun(behind, newBlock, 1)
+            leftBlocks += delta
+        else:
+            pushRun(facing, newBlock, 1)
+        steps += blockSteps
+        base = newBase
+        delta = newDelta
+
+    # Put the blocks back onto the tape with the head at the edge of the block
+    # it is facing, growing the tape first if they run off either end.
+    first = 0
+    while lowBlock * k + first <= TAPE_MARGIN:
+        first += machine.growTape(-1)
+    while highBlock * k + first > len(tape) - 1 - TAPE_MARGIN:
+        machine.growTape(1)
+    counts = machine.countCells(lowBlock * k + first, highBlock * k + first)
+    writeRuns(tape, lowBlock * k + first, left, right)
+    if delta > 0:
+        machine.tapeHead = leftBlocks * k + first
+    else:
+        machine.tapeHead = leftBlocks * k + first - 1
+    machine.touchTape(lowBlock * k + first, highBlock * k + first)
+    machine.recountCells(counts, lowBlock * k + first, highBlock * k + first)
+    machine.touchTape(machine.tapeHead, machine.tapeHead + 1)
+    machine.currentState = STATES[base // TABLE_STRIDE]
+    machine.lastMoveDirection = MOVE_DIRECTIONS[delta]
+    machine.currentStep = 'READ'
+    machine.currentTransition = None
+    machine.steps += steps
+    metrics.endRun(machine.steps)
+    if reason != None:
+        return RunResult(reason, steps, time.perf_counter() - start)
+
+    if maxSteps != None:
+        maxSteps -= steps
+    if maxTime != None:
+        maxTime -= time.perf_counter() - start
+    result = machine.runFast(poll, decider, maxSteps, maxTime)
+    result.steps += steps
+    result.elapsed = time.perf_counter() - start
+    return result
@@ -0,0 +1,331 @@
+# Binary execution traces of TMD-3 runs.
+#
+# A TraceRecorder writes every transition made by runFast(trace=...) or by the
+# console's step loop to a file, one byte per transition holding the symbol
+# written, the direction the head moved and the new state. The bytes are kept
+# in a buffer of at most chunkSteps transitions, which is compressed and written
+# out as a chunk when it fills, so recording a long run takes the same memory as
+# a short one. Each chunk starts with a keyframe: the non blank part of the tape,
+# the tape head, state, step count and state transition table at its first
+# transition.
+#
+# A TraceReader finds the chunk holding a step through the index written at the
+# end of the file, or by scanning the chunks if the recording was not closed,
+# and rebuilds the machine at that step from the chunk's keyframe without
+# running the state transition table. A chunk replaces whatever was recorded
+# from its first step on, so a trace of a machine that was rewound or edited
+# reads back as the run it ended up as.
+#
+#   python tmd3Trace.py record beaver5 beaver5.trace
+#   python tmd3Trace.py show beaver5.trace --step 1000000
+import argparse
+import bisect
+import json
+import struct
+import zlib
+import tmd3Engine
+from tmd3Engine import STATES, TABLE_STRIDE, TAPE_MARGIN, MOVE_DELTAS, MOVE_DIRECTIONS
+
+##### Globals
+# The file starts with TRACE_MAGIC and the length of a JSON header holding the
+# trace version and the state transition table when recording started.
+TRACE_MAGIC = b'TMD3TRC\0'
+TRACE_VERSION = 2
+TRACE_HEADER = struct.Struct('<8sI')
+
+# Each chunk starts with CHUNK_MAGIC, its first step, the number of
+# transitions, the head cell, the cell the keyframe starts at, the state and
+# last move direction, and the sizes of the compressed keyframe tape, state
+# transition table (as JSON) and transitions. Version 1 chunks have no table
+# and use the one in the file header.
+CHUNK_MAGIC = b'CHNK'
+CHUNK_HEADER = struct.Struct('<4sQIqqBBIII')
+CHUNK_HEADER_1 = struct.Struct('<4sQIqqBBII')
+
+# The index at the end of the file has an entry (first step, transitions,
+# file offset) for each chunk, followed by the index offset, the number of
+# entries and INDEX_MAGIC.
+INDEX_ENTRY = struct.Struct('<QIQ')
+INDEX_TRAILER = struct.Struct('<QI8s')
+INDEX_MAGIC = b'TMD3TIDX'
+
+# Transitions held in the buffer before they are written out as a chunk.
+TRACE_CHUNK_STEPS = 1 << 20
+
+# The move directions in a chunk header.
+DIRECTIONS = ('L', 'R', ' ')
+
+##### Functions and classes.
+# Pack a transition into a byte: the tape value written, whether the head moved
+# to a lower cell and the index of the new state.
+def packTransition(write, delta, state):
+    return (write * 2 + (delta < 0)) * len(STATES) + state
+
+# Return the byte for each entry of the CompiledTable passed, indexed like it.
+# Halting transitions keep the state they were in.
+def traceCodes(table):
+    codes = bytearray(len(table.writes))
+    for idx in range(len(codes)):
+        goto = table.gotos[idx]
+        if goto == tmd3Engine.UNDEFINED:
+            continue
+        if goto == tmd3Engine.HALT:
+            goto = idx - idx % TABLE_STRIDE
+        codes[idx] = packTransition(table.writes[idx], table.moves[idx], goto // TABLE_STRIDE)
+    return codes
+
+class TraceRecorder():
+
+    def __init__(self, filename, stateTable, chunkSteps=TRACE_CHUNK_STEPS):
+        self.chunkSteps = chunkSteps
+        self.records = bytearray()
+        self.keyframe = None
+        self.first = None
+        self.pending = False
+        self.index = []
+        self.file = open(filename, 'wb')
+        header = json.dumps({'version': TRACE_VERSION, 'stateTable': stateTable}).encode()
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, len(header)))
+        self.file.write(header)
+
+    # The step count the next transition recorded follows on from.
+    def steps(self):
+        return self.first + len(self.records)
+
+    # Write out the transitions buffered and start a new chunk at the machine
+    # passed, which has made steps transitions.
+    def newChunk(self, machine, steps):
+        self.writeChunk()
+        tape = machine.tape
+        start, end = machine.getExtent()
+        self.keyframe = (machine.tapeHead - machine.tapeOrigin, start - machine.tapeOrigin,
+                         STATES.index(machine.currentState), DIRECTIONS.index(machine.lastMoveDirection),
+                         zlib.compress(bytes(tape[start:end]), 1),
+                         zlib.compress(json.dumps(machine.stateTable).encode(), 6))
+        self.first = steps
+        self.pending = False
+
+    # Write the chunk buffered to the file and empty the buffer. The buffer is
+    # emptied in place, as runFast() holds on to it.
+    def writeChunk(self):
+        if self.keyframe == None:
+            return
+        cell, start, state, direction, cells, stateTable = self.keyframe
+        records = zlib.compress(self.records, 6)
+        self.index.append((self.first, len(self.records), self.file.tell()))
+        self.file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, self.first, len(self.records), cell, start,
+                                          state, direction, len(cells), len(stateTable), len(records)))
+        self.file.write(cells)
+        self.file.write(stateTable)
+        self.file.write(records)
+        self.keyframe = None
+        del self.records[:]
+
+    # Called by runFast() before it runs. Starts a new chunk if the machine has
+    # moved on (or back) since the last transition recorded. Returns the
+    # transition bytes for the CompiledTable passed.
+    def start(self, machine, table):
+        if self.keyframe == None or machine.steps != self.steps():
+            self.newChunk(machine, machine.steps)
+        return traceCodes(table)
+
+    # Called by the step loop at the READ step of a transition.
+    def begin(self, machine):
+        if self.keyframe == None or machine.steps != self.steps():
+            self.newChunk(machine, machine.steps)
+        elif len(self.records) >= self.chunkSteps:
+            self.newChunk(machine, machine.steps)
+        self.pending = True
+
+    # Called by the step loop once the transition begun has set the new state.
+    def commit(self, machine):
+        if not self.pending:
+            return
+        self.pending = False
+        delta = MOVE_DELTAS[machine.lastMoveDirection]
+        write = machine.tape[machine.tapeHead - delta]
+        self.records.append(packTransition(write, delta, STATES.index(machine.currentState)))
+
+    # Call when the tape or state transition table is edited, so the next
+    # transition starts a new chunk.
+    def edited(self, machine):
+        if self.keyframe != None:
+            self.newChunk(machine, machine.steps)
+
+    # Write out the last chunk and the index, and close the file.
+    def close(self):
+        self.writeChunk()
+        offset = self.file.tell()
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(INDEX_TRAILER.pack(offset, len(self.index), INDEX_MAGIC))
+        self.file.close()
+
+class TraceReader():
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        magic, size = TRACE_HEADER.unpack(self.file.read(TRACE_HEADER.size))
+        if magic != TRACE_MAGIC:
+            raise ValueError('{0} is not a TMD-3 trace.'.format(filename))
+        header = json.loads(self.file.read(size).decode())
+        if header['version'] > TRACE_VERSION:
+            raise ValueError('{0} is a newer trace version ({1}).'.format(filename, header['version']))
+        self.stateTable = header['stateTable']
+        self.chunkHeader = CHUNK_HEADER
+        if header['version'] < 2:
+            self.chunkHeader = CHUNK_HEADER_1
+        self.chunksStart = self.file.tell()
+
+        # Use the index at the end, or find the chunks if there is none.
+        self.file.seek(0, 2)
+        size = self.file.tell()
+        entries = self.readIndex(size)
+        if entries == None:
+            entries = self.scanChunks(size)
+
+        # Each chunk replaces what came before it from its first step on.
+        self.chunks = []
+        for first, count, offset in entries:
+            while self.chunks and self.chunks[-1][0] >= first:
+                self.chunks.pop()
+            if self.chunks:
+                previous = self.chunks[-1]
+                if previous[0] + previous[1] > first:
+                    self.chunks[-1] = (previous[0], first - previous[0], previous[2])
+            self.chunks.append((first, count, offset))
+        self.firsts = [chunk[0] for chunk in self.chunks]
+
+    # Return the index entries from the end of the file, or None if the file
+    # has no index.
+    def readIndex(self, size):
+        if size - self.chunksStart < INDEX_TRAILER.size:
+            return None
+        self.file.seek(size - INDEX_TRAILER.size)
+        offset, count, magic = INDEX_TRAILER.unpack(self.file.read(INDEX_TRAILER.size))
+        if magic != INDEX_MAGIC:
+            return None
+        self.file.seek(offset)
+        data = self.file.read(count * INDEX_ENTRY.size)
+        return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(count)]
+
+    # Return the index entries of the whole chunks found by reading through the
+    # file. A chunk cut short at the end is left out.
+    def scanChunks(self, size):
+        entries = []
+        offset = self.chunksStart
+        chunkHeader = self.chunkHeader
+        while offset + chunkHeader.size <= size:
+            self.file.seek(offset)
+            header = chunkHeader.unpack(self.file.read(chunkHeader.size))
+            if header[0] != CHUNK_MAGIC:
+                break
+            end = offset + chunkHeader.size + sum(header[7:])
+            if end > size:
+                break
+            entries.append((header[1], header[2], offset))
+            offset = end
+        return entries
+
+    # The first and last steps the trace can rebuild the machine at.
+    def firstStep(self):
+        return self.chunks[0][0]
+
+    def lastStep(self):
+        return self.chunks[-1][0] + self.chunks[-1][1]
+
+    # Return the chunk at the offset passed as (header, tape cells, state
+    # transition table, transitions).
+    def readChunk(self, offset):
+        self.file.seek(offset)
+        header = self.chunkHeader.unpack(self.file.read(self.chunkHeader.size))
+        cells = zlib.decompress(self.file.read(header[7]))
+        stateTable = self.stateTable
+        if self.chunkHeader == CHUNK_HEADER:
+            stateTable = json.loads(zlib.decompress(self.file.read(header[8])).decode())
+        records = zlib.decompress(self.file.read(header[-1]))
+        return header, cells, stateTable, records
+
+    # Return a new machine as it was after step transitions, at its READ step.
+    def machineAt(self, step):
+        if not self.chunks or step < self.firstStep() or step > self.lastStep():
+            raise ValueError('Step {0} is not in the trace.'.format(step))
+        first, count, offset = self.chunks[max(0, bisect.bisect_right(self.firsts, step) - 1)]
+        header, cells, stateTable, records = self.readChunk(offset)
+        cell, start, state, direction = header[3:7]
+
+        machine = tmd3Engine.Machine()
+        machine.stateTable = {key: list(transition) for key, transition in stateTable.items()}
+        while machine.tapeOrigin + start < TAPE_MARGIN:
+            machine.growTape(-1)
+        while machine.tapeOrigin + start + len(cells) > len(machine.tape) - TAPE_MARGIN:
+            machine.growTape(1)
+        # Place the head first, as the tape can grow at the left to make room
+        # for it and move where the keyframe's cells go.
+        machine.tapeHead = machine.tapeOrigin + cell
+        machine.shiftHead(0)
+        tape = machine.tape
+        position = machine.tapeOrigin + start
+        tape[position:position+len(cells)] = cells
+        machine.touchTape(position, position + len(cells))
+
+        # Play the transitions up to step onto the keyframe.
+        head = machine.tapeHead
+        right = len(tape) - 1 - TAPE_MARGIN
+        delta = MOVE_DELTAS[DIRECTIONS[direction]]
+        size = len(STATES)
+        for code in records[:step-first]:
+            tape[head] = code // (2 * size)
+            delta = -1 if code // size % 2 else 1
+            head += delta
+            state = code % size
+            if head < TAPE_MARGIN or head > right:
+                machine.tapeHead = head
+                machine.shiftHead(0)
+                head = machine.tapeHead
+                right = len(tape) - 1 - TAPE_MARGIN
+        machine.tapeHead = head
+        machine.touchReach(cell, step - first)
+        machine.recount()
+        machine.currentState = STATES[state]
+        machine.lastMoveDirection = MOVE_DIRECTIONS[delta]
+        machine.steps = step
+        return machine
+
+    def close(self):
+        self.file.close()
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Record or read back a TMD-3 execution trace.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help='run a saved workspace to the end, recording a trace')
+    record.add_argument('workspace', help='saved workspace to run')
+    record.add_argument('trace', help='trace file to write')
+    record.add_argument('--steps', type=int, help='most transitions to run')
+    show = commands.add_parser('show', help='show the machine at a step of a trace')
+    show.add_argument('trace', help='trace file to read')
+    show.add_argument('--step', type=int, help='step to show, the last one if left out')
+    options = parser.parse_args(args)
+
+    if options.command == 'record':
+        machine = tmd3Engine.Machine()
+        machine.loadWorkspace(options.workspace)
+        recorder = TraceRecorder(options.trace, machine.stateTable)
+        try:
+            result = machine.runFast(maxSteps=options.steps, trace=recorder)
+        finally:
+            recorder.close()
+        print('{0} after {1:,} steps in {2:.2f} s.'.format(result.reason, machine.steps, result.elapsed))
+    else:
+        reader = TraceReader(options.trace)
+        step = options.step
+        if step == None:
+            step = reader.lastStep()
+        machine = reader.machineAt(step)
+        reader.close()
+        print('Step {0:,} of {1:,} to {2:,}, state {3}, head at cell {4}.'.format(step, reader.firstStep(),
+              reader.lastStep(), machine.currentState, machine.tapeHead - machine.tapeOrigin))
+        print(machine.dumpWorkspace())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+# Lockstep NumPy engine that runs many TMD-3 machines at once.
+#
+# The tapes of all of the machines are rows of one 2-D uint8 array, and the
+# heads, states and compiled state transition tables are arrays with one entry
+# per machine. Each step advances every machine still running with fancy
+# indexing, and machines that stop are dropped from the arrays. The results are
+# the same as running each machine with Machine.runFast().
+#
+# This module needs NumPy, which the rest of the TMD-3 does not. Run it on its
+# own to compare it with the scalar engine:
+#
+#   python tmd3Vector.py --machines 2000 --steps 10000
+import argparse
+import random
+import time
+import numpy
+import tmd3Engine
+from tmd3Engine import CompiledTable, RunResult, STATES, SYMBOLS, TABLE_STRIDE
+from tmd3Engine import UNDEFINED, HALT, BOUNDARY, MOVE_DELTAS, MOVE_DIRECTIONS
+
+##### Globals
+# Steps made between checks that no head is near the end of its tape row. The
+# rows are grown to keep this many cells either side of every head.
+VECTOR_CHECK_STEPS = 64
+
+# Settings for the benchmark.
+DEFAULT_MACHINES = 2000
+DEFAULT_STEPS = 10000
+HALT_CHANCE = 0.05
+
+##### Functions and classes.
+# Run the machines passed in lockstep until each has halted, found an undefined
+# transition, reached a 'b' boundary or made maxSteps transitions. Returns a
+# list with a RunResult for each machine. The elapsed time of each result is
+# the time taken for the whole set.
+def runMachines(machines, maxSteps):
+    start = time.perf_counter()
+    count = len(machines)
+    size = len(STATES) * TABLE_STRIDE
+    margin = VECTOR_CHECK_STEPS
+
+    # Stack the compiled tables into flat arrays indexed by row*size + base + symbol.
+    writes = numpy.zeros((count, size), numpy.uint8)
+    moves = numpy.zeros((count, size), numpy.int64)
+    gotos = numpy.zeros((count, size), numpy.int64)
+    boundaries = numpy.zeros((count, size), bool)
+    transitions = []
+    for row, machine in enumerate(machines):
+        table = CompiledTable(machine.stateTable)
+        writes[row] = table.writes
+        moves[row] = table.moves
+        gotos[row] = table.gotos
+        boundaries[row] = [nxt == BOUNDARY for nxt in table.nexts]
+        transitions.append(table.transitions)
+    writes = writes.ravel()
+    moves = moves.ravel()
+    gotos = gotos.ravel()
+    boundaries = boundaries.ravel()
+    special = (gotos < 0) | boundaries
+
+    # Copy the non blank part of each tape (and the cell under the head) into
+    # its row. Cell column of a row is tape position column - shifts[row].
+    starts = []
+    ends = []
+    for machine in machines:
+        first, last = machine.getExtent()
+        starts.append(min(first, machine.tapeHead))
+        ends.append(max(last, machine.tapeHead + 1))
+    width = max(end - first for first, end in zip(starts, ends)) + 4 * margin
+    tapes = numpy.zeros((count, width), numpy.uint8)
+    shifts = numpy.zeros(count, numpy.int64)
+    for row, machine in enumerate(machines):
+        tapes[row, 2*margin:2*margin+ends[row]-starts[row]] = numpy.frombuffer(machine.tape, numpy.uint8, ends[row]-starts[row], starts[row])
+        shifts[row] = 2 * margin - starts[row]
+
+    # The running machines. rows holds their row numbers and the other arrays
+    # line up with it.
+    rows = numpy.arange(count)
+    heads = numpy.array([machine.tapeHead for machine in machines], numpy.int64) + shifts
+    bases = numpy.array([STATES.index(machine.currentState) * TABLE_STRIDE for machine in machines], numpy.int64)
+    deltas = numpy.array([MOVE_DELTAS[machine.lastMoveDirection] for machine in machines], numpy.int64)
+    rowBases = rows * size
+    cells = rows * width + heads
+
+    # How each machine finished, filled in as they stop.
+    finalHeads = numpy.zeros(count, numpy.int64)
+    finalBases = numpy.zeros(count, numpy.int64)
+    finalDeltas = numpy.zeros(count, numpy.int64)
+    finalSteps = numpy.zeros(count, numpy.int64)
+    finalIndexes = [None] * count
+    reasons = ['budget'] * count
+
+    steps = 0
+    while rows.size and steps < maxSteps:
+        # Grow every row on both sides if any head could reach an end.
+        if heads.min() < margin or heads.max() >= width - margin:
+            tapes = numpy.pad(tapes, ((0, 0), (width, width)))
+            heads += width
+            finalHeads += width
+            shifts += width
+            width *= 3
+            cells = rows * width + heads
+        flatTapes = tapes.ravel()
+
+        for i in range(min(margin, maxSteps - steps)):
+            flat = rowBases + bases + flatTapes[cells]
+            stops = special[flat]
+            if stops.any():
+                # Stop the machines with an undefined transition, a 'b'
+                # boundary they would cross, or a halt.
+                nexts = gotos[flat]
+                undefined = nexts == UNDEFINED
+                crossing = boundaries[flat] & (moves[flat] == deltas)
+                halting = nexts == HALT
+                stopping = undefined | crossing | halting
+                if stopping.any():
+                    written = stopping & ~undefined
+                    flatTapes[cells[written]] = writes[flat[written]]
+                    moved = halting & ~crossing
+                    heads[moved] += moves[flat[moved]]
+                    deltas[moved] = moves[flat[moved]]
+                    for position in numpy.flatnonzero(stopping):
+                        row = rows[position]
+                        finalHeads[row] = heads[position]
+                        finalBases[row] = bases[position]
+                        finalDeltas[row] = deltas[position]
+                        finalIndexes[row] = flat[position] - rowBases[position]
+                        if undefined[position]:
+                            reasons[row] = 'undefined'
+                            finalSteps[row] = steps
+                        elif crossing[position]:
+                            reasons[row] = 'boundary'
+                            finalSteps[row] = steps
+                        else:
+                            reasons[row] = 'halted'
+                            finalSteps[row] = steps + 1
+                    keep = ~stopping
+                    rows = rows[keep]
+                    rowBases = rowBases[keep]
+                    heads = heads[keep]
+                    cells = cells[keep]
+                    bases = bases[keep]
+                    deltas = deltas[keep]
+                    flat = flat[keep]
+                    if not rows.size:
+                        break
+
+            flatTapes[cells] = writes[flat]
+            deltas = moves[flat]
+            heads += deltas
+            cells += deltas
+            bases = gotos[flat]
+            steps += 1
+
+    # The machines left ran out of steps.
+    finalHeads[rows] = heads
+    finalBases[rows] = bases
+    finalDeltas[rows] = deltas
+    finalSteps[rows] = steps
+
+    # Copy everything back into the machines.
+    elapsed = time.perf_counter() - start
+    results = []
+    for row, machine in enumerate(machines):
+        # Grow the machine's tape to hold the whole row.
+        shift = int(shifts[row])
+        while -shift < 0:
+            shift -= machine.growTape(-1)
+        while width - shift > len(machine.tape):
+            machine.growTape(1)
+        counts = machine.countCells(-shift, width - shift)
+        machine.tape[-shift:width-shift] = tapes[row].tobytes()
+        machine.tapeHead = int(finalHeads[row]) - shift
+        machine.shiftHead(0)
+        machine.touchTape(-shift, width - shift)
+        machine.recountCells(counts, -shift, width - shift)
+        machine.currentState = STATES[int(finalBases[row]) // TABLE_STRIDE]
+        machine.lastMoveDirection = MOVE_DIRECTIONS[int(finalDeltas[row])]
+        machine.steps += int(finalSteps[row])
+        if reasons[row] == 'boundary':
+            machine.currentStep = 'MOVE'
+        elif reasons[row] == 'halted':
+            machine.currentStep = 'GOTO'
+        else:
+            machine.currentStep = 'READ'
+        if finalIndexes[row] == None:
+            machine.currentTransition = None
+        else:
+            machine.currentTransition = transitions[row][int(finalIndexes[row])]
+        results.append(RunResult(reasons[row], int(finalSteps[row]), elapsed))
+    return results
+
+# Return a random, fully defined state transition table. Each transition halts
+# with the chance passed.
+def randomTable(rng, haltChance):
+    stateTable = {}
+    for state in STATES:
+        for symbol in SYMBOLS:
+            goto = rng.choice(STATES)
+            if rng.random() < haltChance:
+                goto = 'H'
+            stateTable[state+symbol] = [symbol, rng.choice(SYMBOLS), rng.choice('LR'), goto]
+    return stateTable
+
+# Run the same random tables with runFast() and runMachines(), check that the
+# results agree and print the speed of each.
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Compare the lockstep NumPy engine with the scalar engine.')
+    parser.add_argument('--machines', type=int, default=DEFAULT_MACHINES, help='number of random tables')
+    parser.add_argument('--steps', type=int, default=DEFAULT_STEPS, help='most transitions for each table')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the random tables')
+    options = parser.parse_args(args)
+
+    rng = random.Random(options.seed)
+    tables = [randomTable(rng, HALT_CHANCE) for i in range(options.machines)]
+
+    scalar = []
+    for stateTable in tables:
+        machine = tmd3Engine.Machine()
+        machine.stateTable = stateTable
+        scalar.append(machine)
+    start = time.perf_counter()
+    scalarResults = [machine.runFast(maxSteps=options.steps) for machine in scalar]
+    scalarTime = time.perf_counter() - start
+
+    vector = []
+    for stateTable in tables:
+        machine = tmd3Engine.Machine()
+        machine.stateTable = stateTable
+        vector.append(machine)
+    start = time.perf_counter()
+    vectorResults = runMachines(vector, options.steps)
+    vectorTime = time.perf_counter() - start
+
+    mismatches = 0
+    for one, other, oneResult, otherResult in zip(scalar, vector, scalarResults, vectorResults):
+        if (oneResult.reason, one.steps, one.tapeHead - one.tapeOrigin, one.currentState,
+                bytes(one.tape).strip(b'\0')) != (otherResult.reason, other.steps, other.tapeHead - other.tapeOrigin,
+                other.currentState, bytes(other.tape).strip(b'\0')):
+            mismatches += 1
+
+    steps = sum(machine.steps for machine in scalar)
+    print('{0} machines, {1} transitions, {2} mismatches.'.format(options.machines, steps, mismatches))
+    print('Scalar: {0:.3f} s, {1:,.0f} transitions/s'.format(scalarTime, steps / scalarTime))
+    print('Vector: {0:.3f} s, {1:,.0f} transitions/s'.format(vectorTime, steps / vectorTime))
+
+if __name__ == '__main__':
+    main()
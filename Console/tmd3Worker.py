@@ -0,0 +1,254 @@
+# Background workers that run a TMD-3 machine for the console's RUN mode.
+#
+# RunWorker runs the machine in a thread so the console keeps drawing while it
+# goes on. At each poll the engine copies its tape head, state and symbol counts
+# into the machine, and the worker publishes a Progress snapshot of the cells
+# around the head, the state, the step count and the number of non blank cells.
+# The console shows the latest snapshot each frame (getProgress()) and asks the
+# worker to stop with halt(), which the engine sees at its next poll. Nothing
+# else may touch the machine until the worker is done. A worker can be limited
+# to maxSteps transitions, which the console uses to fast forward, and can
+# record a trace (see tmd3Trace.py) of the plain machine's run.
+#
+# ProcessRunWorker does the same in a separate process, so the run does not
+# share the interpreter with the console. The snapshot is written into a small
+# shared memory block guarded by a seqlock version counter: the writer makes the
+# version odd, writes the fields and makes it even again, and the reader
+# retries until it sees the same even version before and after reading. The
+# machine is sent back once, when the run is over. The process is forked where
+# the platform can, as the console opens its window and probes the GPIO when
+# it is imported, and the spawn and forkserver start methods (forkserver is the
+# default on Linux from Python 3.14) import the main module again in the child.
+#
+# The macro machine keeps the tape in blocks while it runs, so with it only the
+# step count moves until the run ends.
+import multiprocessing
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+import tmd3Macro
+from tmd3Engine import TAPE_CELLS, STATES
+
+##### Globals
+# Layout of the shared progress block: the seqlock version, then the head cell
+# number, the steps made, the non blank cells and the state index, then the
+# TAPE_CELLS cells centered on the head.
+PROGRESS_VERSION = struct.Struct('<Q')
+PROGRESS_FIELDS = struct.Struct('<qQQB')
+PROGRESS_CELLS = PROGRESS_VERSION.size + PROGRESS_FIELDS.size
+PROGRESS_SIZE = PROGRESS_CELLS + TAPE_CELLS
+
+# The multiprocessing context worker processes are started from: fork where the
+# platform has it, otherwise the default.
+if 'fork' in multiprocessing.get_all_start_methods():
+    PROCESS_CONTEXT = multiprocessing.get_context('fork')
+else:
+    PROCESS_CONTEXT = multiprocessing.get_context()
+
+##### Functions and classes.
+# What the console shows of a running machine: the TAPE_CELLS cells centered on
+# the tape head, the cell number of the head, the state, the steps made and the
+# number of non blank cells (sigma).
+class Progress():
+
+    def __init__(self, cells, cell, state, steps, sigma):
+        self.cells = cells
+        self.cell = cell
+        self.state = state
+        self.steps = steps
+        self.sigma = sigma
+
+# Return the progress of the machine passed, as it is now.
+def machineProgress(machine):
+    head = machine.tapeHead
+    half = int(TAPE_CELLS/2)
+    cells = bytes(machine.tape[head-half:head+half+1])
+    return Progress(cells, head - machine.tapeOrigin, machine.currentState, machine.getMetrics()['steps'],
+                    machine.getSigma())
+
+class RunWorker():
+
+    def __init__(self, machine, macro=False, decider=None, maxSteps=None, trace=None):
+        self.machine = machine
+        self.macro = macro
+        self.decider = decider
+        self.maxSteps = maxSteps
+        self.trace = trace
+        self.haltRequest = threading.Event()
+        self.result = None
+        self.error = None
+        self.publish()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    # Start the run.
+    def start(self):
+        self.thread.start()
+
+    # Run the machine until it stops. Called in the worker thread.
+    def run(self):
+        try:
+            if self.macro:
+                self.result = tmd3Macro.runMacro(self.machine, poll=self.poll, decider=self.decider, maxSteps=self.maxSteps)
+            else:
+                self.result = self.machine.runFast(self.poll, self.decider, self.maxSteps, trace=self.trace)
+        except Exception as ex:
+            self.error = ex
+        self.publish()
+
+    # Called by the engine about every POLL_INTERVAL seconds. Returns True once
+    # halt() has been called.
+    def poll(self):
+        self.publish()
+        return self.haltRequest.is_set()
+
+    # Replace the progress snapshot with the machine as it is now. The snapshot
+    # is built first and then swapped in whole, so readers always see a
+    # consistent one.
+    def publish(self):
+        self.progress = machineProgress(self.machine)
+
+    # Return the latest progress snapshot.
+    def getProgress(self):
+        return self.progress
+
+    # Ask the run to stop at the next poll.
+    def halt(self):
+        self.haltRequest.set()
+
+    # True once the run has stopped.
+    def isDone(self):
+        return not self.thread.is_alive()
+
+    # Wait for the run to stop and return its RunResult. Raises any exception
+    # the run raised.
+    def finish(self):
+        self.thread.join()
+        if self.error != None:
+            raise self.error
+        return self.result
+
+# A Progress snapshot in a shared memory buffer, guarded by a seqlock.
+class ProgressBlock():
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    # Write the progress passed. Only one process may write.
+    def write(self, progress):
+        buffer = self.buffer
+        version = PROGRESS_VERSION.unpack_from(buffer, 0)[0]
+        PROGRESS_VERSION.pack_into(buffer, 0, version + 1)
+        PROGRESS_FIELDS.pack_into(buffer, PROGRESS_VERSION.size, progress.cell, progress.steps, progress.sigma,
+                                  STATES.index(progress.state))
+        buffer[PROGRESS_CELLS:PROGRESS_SIZE] = progress.cells
+        PROGRESS_VERSION.pack_into(buffer, 0, version + 2)
+
+    # Return the last progress written, retrying while a write is under way.
+    def read(self):
+        buffer = self.buffer
+        while True:
+            version = PROGRESS_VERSION.unpack_from(buffer, 0)[0]
+            if version % 2 == 0:
+                cell, steps, sigma, state = PROGRESS_FIELDS.unpack_from(buffer, PROGRESS_VERSION.size)
+                cells = bytes(buffer[PROGRESS_CELLS:PROGRESS_SIZE])
+                if PROGRESS_VERSION.unpack_from(buffer, 0)[0] == version:
+                    return Progress(cells, cell, STATES[state], steps, sigma)
+            time.sleep(0)
+
+# Run the machine passed in a worker process for at most maxSteps transitions,
+# publishing its progress to the shared memory block named. Sends (result,
+# error, machine) back down the connection when the run is over.
+def runProcess(machine, macro, decider, maxSteps, name, haltRequest, connection):
+    memory = shared_memory.SharedMemory(name=name)
+    block = ProgressBlock(memory.buf)
+    def poll():
+        block.write(machineProgress(machine))
+        return haltRequest.is_set()
+    result = None
+    error = None
+    try:
+        if macro:
+            result = tmd3Macro.runMacro(machine, poll=poll, decider=decider, maxSteps=maxSteps)
+        else:
+            result = machine.runFast(poll, decider, maxSteps)
+    except Exception as ex:
+        error = ex
+    block.write(machineProgress(machine))
+    del block
+    memory.close()
+    connection.send((result, error, machine))
+    connection.close()
+
+class ProcessRunWorker():
+
+    def __init__(self, machine, macro=False, decider=None, maxSteps=None, context=PROCESS_CONTEXT):
+        self.machine = machine
+        self.memory = shared_memory.SharedMemory(create=True, size=PROGRESS_SIZE)
+        self.block = ProgressBlock(self.memory.buf)
+        self.block.write(machineProgress(machine))
+        self.haltRequest = context.Event()
+        self.connection, childConnection = context.Pipe(False)
+        self.process = context.Process(target=runProcess, daemon=True,
+            args=(machine, macro, decider, maxSteps, self.memory.name, self.haltRequest, childConnection))
+        self.reply = None
+
+    # Start the run.
+    def start(self):
+        self.machine.metrics.startRun(self.machine.steps, time.perf_counter())
+        self.process.start()
+
+    # Return the latest progress, straight from the shared memory block. The
+    # steps are sampled into the machine's metrics for the HUD.
+    def getProgress(self):
+        progress = self.block.read()
+        self.machine.metrics.sample(progress.steps)
+        return progress
+
+    # Ask the run to stop at the next poll.
+    def halt(self):
+        self.haltRequest.set()
+
+    # True once the run has stopped. The machine is read from the connection
+    # as soon as it arrives so the worker process is not left waiting to send it.
+    def isDone(self):
+        if self.reply == None and self.connection.poll():
+            self.reply = self.connection.recv()
+        return self.reply != None or not self.process.is_alive()
+
+    # Wait for the run to stop, copy the machine the worker sent back into this
+    # one and return its RunResult. Raises any exception the run raised.
+    def finish(self):
+        try:
+            if self.reply == None:
+                try:
+                    self.reply = self.connection.recv()
+                except EOFError:
+                    raise RuntimeError('The worker process stopped without a result.')
+        finally:
+            self.process.join()
+            self.connection.close()
+            del self.block
+            self.memory.close()
+            self.memory.unlink()
+        result, error, other = self.reply
+        machine = self.machine
+        machine.tape[:] = other.tape
+        machine.tapeHead = other.tapeHead
+        machine.tapeOrigin = other.tapeOrigin
+        machine.touchedStart = other.touchedStart
+        machine.touchedEnd = other.touchedEnd
+        machine.symbolCounts = other.symbolCounts
+        machine.currentState = other.currentState
+        machine.currentStep = other.currentStep
+        machine.currentTransition = other.currentTransition
+        machine.lastMoveDirection = other.lastMoveDirection
+        machine.steps = other.steps
+        machine.hits = other.hits
+        machine.metrics.pollTime = other.metrics.pollTime
+        machine.metrics.polls = other.metrics.polls
+        machine.metrics.haltLatency = other.metrics.haltLatency
+        machine.metrics.endRun(machine.steps)
+        if error != None:
+            raise error
+        return result